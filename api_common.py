@@ -0,0 +1,374 @@
+import base64
+import json
+import os
+import zlib
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+# Request parsing and validation shared by the Flask API (app.py) and the
+# asyncio API (async_app.py), so both accept and reject exactly the same input.
+
+# Upper bound for per_page on the list endpoints
+MAX_PER_PAGE = int(os.getenv('API_MAX_PER_PAGE', '1000'))
+# Largest (decompressed) JSON body accepted by POST /payment_amount
+MAX_REQUEST_BYTES = int(os.getenv('API_MAX_REQUEST_BYTES', str(64 * 1024 * 1024)))
+# Rows per multi-row INSERT in POST /payment_amount
+UPSERT_BATCH_SIZE = int(os.getenv('API_UPSERT_BATCH_SIZE', '1000'))
+# Bounds of payment_amount.customer_id (INT) and sum_payment (NUMERIC(10, 2))
+INT4_MIN, INT4_MAX = -2 ** 31, 2 ** 31 - 1
+MAX_SUM_PAYMENT = Decimal(10) ** 8
+
+# List resources served as GET /<name>:
+# name -> {"table", "key", "columns", "time_filter", "filters"}
+RESOURCES = {}
+
+
+def register_resource(name, table, key, columns, time_filter=None, filters=None):
+    """Register a paginated list endpoint over a table or view.
+
+    columns are the columns returned, in response order; clients can
+    narrow them with ?fields=. time_filter is the (lower, upper) column
+    pair matched against start_date/end_date, and filters maps columns
+    usable as ?column=value equality filters to their Postgres type.
+    """
+    RESOURCES[name] = {
+        "table": table,
+        "key": key,
+        "columns": tuple(columns),
+        "time_filter": time_filter,
+        "filters": dict(filters or {}),
+    }
+
+
+register_resource("customers", "customers", "customer_id",
+                  ["customer_id", "name", "email", "phone", "created_at"],
+                  time_filter=("created_at", "created_at"))
+# Subscriptions match when their [start_date, end_date] period overlaps the requested window
+register_resource("subscriptions", "subscriptions", "subscription_id",
+                  ["subscription_id", "customer_id", "subscription_type", "start_date", "end_date"],
+                  time_filter=("end_date", "start_date"),
+                  filters={"customer_id": "bigint", "subscription_type": "text"})
+register_resource("payments", "payments", "payment_id",
+                  ["payment_id", "subscription_id", "payment_date", "amount"],
+                  time_filter=("payment_date", "payment_date"),
+                  filters={"subscription_id": "bigint"})
+register_resource("usage", "usage", "usage_id",
+                  ["usage_id", "subscription_id", "data_usage", "call_minutes", "sms_count", "usage_date"],
+                  filters={"subscription_id": "bigint"})
+register_resource("usage_summary", "usage_summary", "customer_id",
+                  ["customer_id", "usage_count", "call_minutes_count", "call_minutes_sum", "data_usage_count",
+                   "data_usage_sum", "sms_count_count", "sms_count_sum", "avg_call_minutes", "avg_data_usage",
+                   "avg_sms_count"])
+register_resource("payment_amount", "payment_amount", "id",
+                  ["id", "customer_id", "sum_payment", "created_at"],
+                  time_filter=("created_at", "created_at"),
+                  filters={"customer_id": "bigint"})
+
+
+# Grouped aggregates served as GET /aggregates/<name>:
+# name -> {"query", "group_by", "columns", "time_column", "tables"}
+AGGREGATES = {}
+
+
+def register_aggregate(name, query, group_by, columns, time_column, tables):
+    """Register an aggregate that Postgres computes and pages over by group.
+
+    query is a grouped SELECT in which {group} stands for the grouping
+    expression and {window} for the time-window terms on time_column
+    (rendered as "AND ..." conditions, or nothing without
+    start_date/end_date). group_by maps the accepted ?group_by= values to
+    their (SQL expression, key type), the first being the default; the key
+    type (int, str or date) is what a cursor for that grouping must hold.
+    columns are the aggregate columns that follow the group key. tables
+    are the relations read, which the response cache is keyed on.
+    """
+    AGGREGATES[name] = {
+        "query": query,
+        "group_by": dict(group_by),
+        "columns": tuple(columns),
+        "time_column": time_column,
+        "tables": tuple(tables),
+    }
+
+
+# Every customer with a subscription, with zero for those without payments in the window;
+# also the payment_totals report (reports.py)
+register_aggregate(
+    "payment_totals",
+    """
+        SELECT
+            {group},
+            COALESCE(SUM(p.amount), 0) AS sum_payment,
+            COUNT(p.payment_id) AS payment_count
+        FROM subscriptions s
+        LEFT JOIN payments p ON p.subscription_id = s.subscription_id {window}
+        GROUP BY 1
+    """,
+    group_by={"customer_id": ("s.customer_id", int)},
+    columns=["sum_payment", "payment_count"],
+    time_column="p.payment_date",
+    tables=["subscriptions", "payments"],
+)
+register_aggregate(
+    "revenue_by_subscription_type",
+    """
+        SELECT
+            {group},
+            COUNT(DISTINCT s.customer_id) AS customers,
+            COUNT(p.payment_id) AS payments,
+            COALESCE(SUM(p.amount), 0) AS revenue
+        FROM subscriptions s
+        LEFT JOIN payments p ON p.subscription_id = s.subscription_id {window}
+        GROUP BY 1
+    """,
+    group_by={"subscription_type": ("s.subscription_type", str)},
+    columns=["customers", "payments", "revenue"],
+    time_column="p.payment_date",
+    tables=["subscriptions", "payments"],
+)
+register_aggregate(
+    "usage_averages",
+    """
+        SELECT
+            {group},
+            COUNT(*) AS usage_count,
+            ROUND(AVG(u.call_minutes), 2) AS avg_call_minutes,
+            ROUND(AVG(u.data_usage), 2) AS avg_data_usage,
+            ROUND(AVG(u.sms_count), 2) AS avg_sms_count
+        FROM usage u
+        JOIN subscriptions s ON s.subscription_id = u.subscription_id
+        WHERE TRUE {window}
+        GROUP BY 1
+    """,
+    group_by={
+        "customer_id": ("s.customer_id", int),
+        "subscription_id": ("u.subscription_id", int),
+        "subscription_type": ("s.subscription_type", str),
+        "usage_date": ("u.usage_date", date),
+    },
+    columns=["usage_count", "avg_call_minutes", "avg_data_usage", "avg_sms_count"],
+    time_column="u.usage_date",
+    tables=["usage", "subscriptions"],
+)
+
+
+def encode_cursor(last_key):
+    """Build an opaque next_cursor token from the last primary key of a page."""
+    raw = json.dumps({"k": last_key}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token, types=(int,)):
+    """Return the key stored in a cursor token, or raise ValueError if it is not one of types."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))["k"]
+    except Exception:
+        raise ValueError(f"Invalid cursor: {token}")
+    # JSON true/false would pass as int
+    if not isinstance(key, types) or isinstance(key, bool):
+        raise ValueError(f"Invalid cursor: {token}")
+    return key
+
+
+def decode_group_cursor(token, key_type):
+    """Return the group key stored in an aggregate cursor, or raise ValueError if it is not a key_type.
+
+    Null groups sort first, so None is accepted for every grouping; dates
+    travel as ISO strings and are returned as date objects.
+    """
+    if key_type is date:
+        key = decode_cursor(token, (str, type(None)))
+        try:
+            return None if key is None else date.fromisoformat(key)
+        except ValueError:
+            raise ValueError(f"Invalid cursor: {token}")
+    return decode_cursor(token, (key_type, type(None)))
+
+
+def parse_window_bound(value, name):
+    """Parse a start_date/end_date parameter as an ISO date or datetime."""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO date (YYYY-MM-DD) or datetime")
+
+
+def parse_window(args):
+    """Return the (start, end) bounds of the start_date/end_date window, None where absent.
+
+    A date-only end_date includes that whole day; the end bound is exclusive.
+    """
+    start_date = args.get('start_date')
+    end_date = args.get('end_date')
+    lower = parse_window_bound(start_date, "start_date") if start_date else None
+    upper = None
+    if end_date:
+        upper = parse_window_bound(end_date, "end_date")
+        if len(end_date) == 10:
+            upper += timedelta(days=1)
+    return lower, upper
+
+
+def _int_arg(args, name, default=None):
+    # Same leniency as Flask's args.get(type=int): unparsable values count as absent
+    try:
+        return int(args[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def parse_page_args(args):
+    """Read paging and rendering parameters from a query-string mapping.
+
+    Returns (per_page, page, cursor_token, legacy, response_format, render);
+    raises ValueError for an unknown format or render.
+    """
+    per_page = min(max(_int_arg(args, 'per_page', 10), 1), MAX_PER_PAGE)
+    page = _int_arg(args, 'page')
+    cursor_token = args.get('cursor')
+    legacy = page is not None and cursor_token is None
+    response_format = args.get('format', 'records')
+    render = args.get('render', 'app')
+    if response_format not in ("records", "columns"):
+        raise ValueError("format must be 'records' or 'columns'")
+    if render not in ("app", "pg"):
+        raise ValueError("render must be 'app' or 'pg'")
+    return per_page, page, cursor_token, legacy, response_format, render
+
+
+def parse_aggregate_args(aggregate, args):
+    """Read the parameters of an aggregate endpoint from a query-string mapping.
+
+    Returns (group_by, per_page, cursor_token, response_format); raises
+    ValueError for an unknown group_by or format.
+    """
+    choices = list(aggregate["group_by"])
+    group_by = args.get('group_by', choices[0])
+    if group_by not in aggregate["group_by"]:
+        raise ValueError(f"group_by must be one of: {', '.join(choices)}")
+    per_page = min(max(_int_arg(args, 'per_page', 10), 1), MAX_PER_PAGE)
+    response_format = args.get('format', 'records')
+    if response_format not in ("records", "columns"):
+        raise ValueError("format must be 'records' or 'columns'")
+    return group_by, per_page, args.get('cursor'), response_format
+
+
+def parse_fields(resource, args):
+    """Return the columns selected by ?fields=a,b (all by default); the key is always included."""
+    fields = args.get('fields')
+    if not fields:
+        return list(resource["columns"])
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in resource["columns"]]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}; available: {', '.join(resource['columns'])}")
+    if resource["key"] not in requested:
+        requested.insert(0, resource["key"])
+    return list(dict.fromkeys(requested))
+
+
+def parse_filters(resource, args):
+    """Translate start_date, end_date, after and equality filter parameters to conditions.
+
+    Returns [(column, operator, value, pg_type), ...] for the caller to
+    render in its driver's placeholder style. A date-only end_date
+    includes that whole day. ``after`` returns only rows whose primary key
+    is greater than the given value, which lets incremental extracts
+    resume from their last high-water mark.
+    """
+    conditions = []
+    time_filter = resource["time_filter"]
+    if (args.get('start_date') or args.get('end_date')) and time_filter is None:
+        raise ValueError(f"{resource['table']} does not support date filtering")
+    lower, upper = parse_window(args)
+    if lower is not None:
+        conditions.append((time_filter[0], ">=", lower, "timestamp"))
+    if upper is not None:
+        conditions.append((time_filter[1], "<", upper, "timestamp"))
+    after = args.get('after')
+    if after is not None:
+        try:
+            conditions.append((resource["key"], ">", int(after), "bigint"))
+        except ValueError:
+            raise ValueError("after must be an integer key")
+    for column, pg_type in resource["filters"].items():
+        value = args.get(column)
+        if value is None:
+            continue
+        if pg_type == "bigint":
+            try:
+                value = int(value)
+            except ValueError:
+                raise ValueError(f"{column} must be an integer")
+        conditions.append((column, "=", value, pg_type))
+    return conditions
+
+
+def pg_page_body(rows_json, columns, next_cursor, legacy, response_format):
+    """Wrap the JSON text of a Postgres-rendered page in the list response envelope."""
+    if response_format == "columns":
+        body = f'{{"columns":{json.dumps(columns)},'
+        if not legacy:
+            body += f'"next_cursor":{json.dumps(next_cursor)},'
+        body += f'"rows":{rows_json}}}'
+    elif legacy:
+        body = rows_json
+    else:
+        body = f'{{"data":{rows_json},"next_cursor":{json.dumps(next_cursor)}}}'
+    return body + "\n"
+
+
+def decode_json_body(body, content_encoding=None):
+    """Parse a request body as JSON, inflating it first when sent with Content-Encoding: gzip."""
+    if (content_encoding or '').lower() == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, MAX_REQUEST_BYTES + 1)
+        except zlib.error as e:
+            raise ValueError(f"Invalid gzip body: {e}")
+        if len(body) > MAX_REQUEST_BYTES or decompressor.unconsumed_tail:
+            raise ValueError(f"Decompressed body exceeds {MAX_REQUEST_BYTES} bytes")
+    try:
+        return json.loads(body)
+    except ValueError:
+        raise ValueError("Body must be valid JSON")
+
+
+def payment_amount_rows(data):
+    """Validate a POST /payment_amount payload and return its (customer_id, sum_payment) rows.
+
+    A customer may only appear once per upsert statement, so the last
+    entry for it wins. Raises ValueError with the client-facing message.
+    """
+    # Validate that the data is wrapped in a JSON object
+    if not isinstance(data, dict) or "data" not in data:
+        raise ValueError("Payload must be a JSON object with a 'data' key")
+
+    # Extract the list of records from the 'data' key
+    records = data["data"]
+    if not isinstance(records, list):
+        raise ValueError("'data' key must contain a list of JSON objects")
+
+    # Validate each entry in the list
+    required_fields = {"customer_id", "sum_payment"}
+    for index, entry in enumerate(records):
+        if not isinstance(entry, dict):
+            raise ValueError("Each entry in 'data' must be a JSON object")
+        if not required_fields.issubset(entry.keys()):
+            raise ValueError(f"Each entry must include {', '.join(required_fields)}")
+        # Anything Postgres would reject must fail here, before the upsert transaction
+        customer_id = entry["customer_id"]
+        if not isinstance(customer_id, int) or isinstance(customer_id, bool) or not INT4_MIN <= customer_id <= INT4_MAX:
+            raise ValueError(f"data[{index}].customer_id must be an integer")
+        sum_payment = entry["sum_payment"]
+        try:
+            if isinstance(sum_payment, (bool, list, dict)) or sum_payment is None:
+                raise InvalidOperation
+            amount = Decimal(str(sum_payment))
+            # Postgres rounds to cents before checking the precision
+            if not amount.is_finite() or abs(round(amount, 2)) >= MAX_SUM_PAYMENT:
+                raise InvalidOperation
+        except InvalidOperation:
+            raise ValueError(f"data[{index}].sum_payment must be a number below {MAX_SUM_PAYMENT} in absolute value")
+    return list({entry["customer_id"]: (entry["customer_id"], entry["sum_payment"]) for entry in records}.values())
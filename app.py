@@ -1,169 +1,411 @@
-from flask import Flask, jsonify, request
-from db_utils import create_tables, insert_data_to_db, get_db_connection
+from flask import Flask, Response, jsonify, request, stream_with_context
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from psycopg2.pool import PoolError
+from db_utils import migrate, is_empty, insert_data_to_db, refresh_usage_summary, db_connection, pool_stats
+from response_cache import cached_response, invalidate, cache_stats
+from fast_json import FastJSONProvider
+import metrics
+from api_common import (
+    AGGREGATES, RESOURCES, UPSERT_BATCH_SIZE, decode_cursor, decode_group_cursor, decode_json_body, encode_cursor,
+    parse_aggregate_args, parse_fields, parse_filters, parse_page_args, parse_window, payment_amount_rows, pg_page_body,
+)
+from datetime import date
+import csv
+import io
 import logging
+import os
+import time
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logging.info("Starting Flask application...")
 
-@app.route('/customers', methods=['GET'])
-def get_customers():
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
-    offset = (page - 1) * per_page
-
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM customers LIMIT %s OFFSET %s", (per_page, offset))
-    columns = [desc[0] for desc in cur.description]
-    customers = []
-    for row in cur.fetchall():
-        customer = dict(zip(columns, row))
-        customers.append(customer)
-
-    cur.close()
-    conn.close()
-
-    return jsonify(customers)
-
-@app.route('/subscriptions', methods=['GET'])
-def get_subscriptions():
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
-    offset = (page - 1) * per_page
-
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM subscriptions LIMIT %s OFFSET %s", (per_page, offset))
-    columns = [desc[0] for desc in cur.description]
-    subscriptions = []
-    for row in cur.fetchall():
-        subscription = dict(zip(columns, row))
-        subscriptions.append(subscription)
-
-    cur.close()
-    conn.close()
-
-    return jsonify(subscriptions)
-
-
-@app.route('/payments', methods=['GET'])
-def get_payments():
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
-    offset = (page - 1) * per_page
-
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM payments LIMIT %s OFFSET %s", (per_page, offset))
-    columns = [desc[0] for desc in cur.description]
-    payments = []
-    for row in cur.fetchall():
-        payment = dict(zip(columns, row))
-        payments.append(payment)
-
-    cur.close()
-    conn.close()
-
-    return jsonify(payments)
-
-
-@app.route('/usage', methods=['GET'])
-def get_usage():
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
-    offset = (page - 1) * per_page
-
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM usage LIMIT %s OFFSET %s", (per_page, offset))
-    columns = [desc[0] for desc in cur.description]
-    usage_data = []
-    for row in cur.fetchall():
-        usage = dict(zip(columns, row))
-        usage_data.append(usage)
-
-    cur.close()
-    conn.close()
-
-    return jsonify(usage_data)
-
-
-@app.route('/payment_amount', methods=['GET', 'POST'])
+# Rows fetched per round trip by the server-side cursor of /export
+EXPORT_ITERSIZE = int(os.getenv('API_EXPORT_ITERSIZE', '5000'))
+
+
+def build_filters(resource):
+    """Render the shared query-string filters as psycopg2 SQL conditions."""
+    conditions = []
+    params = []
+    for column, operator, value, _ in parse_filters(resource, request.args):
+        conditions.append(sql.SQL(f"{{}} {operator} %s").format(sql.Identifier(column)))
+        params.append(value)
+    return conditions, params
+
+
+def where_clause(conditions):
+    if not conditions:
+        return sql.SQL("")
+    return sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions)
+
+
+def select_list(fields):
+    return sql.SQL(", ").join(map(sql.Identifier, fields))
+
+
+def list_rows(name):
+    """Return one page of a registered resource ordered by its key.
+
+    Clients page with the opaque ``cursor`` token from the previous
+    response's ``next_cursor``, so every page is an index range scan
+    whatever its depth. The legacy ``page`` parameter still works and
+    returns a bare list, now in a stable key order.
+
+    ``fields`` selects a subset of the columns. ``format=columns`` returns
+    {"columns": [...], "rows": [[...]]} instead of one object per row.
+    ``render=pg`` has Postgres build the JSON (numbers stay numbers,
+    timestamps are ISO 8601) and sends its text through without parsing it.
+    """
+    resource = RESOURCES[name]
+    key_column = resource["key"]
+    try:
+        per_page, page, cursor_token, legacy, response_format, render = parse_page_args(request.args)
+        fields = parse_fields(resource, request.args)
+        conditions, params = build_filters(resource)
+        if cursor_token:
+            conditions.append(sql.SQL("{} > %s").format(sql.Identifier(key_column)))
+            params.append(decode_cursor(cursor_token))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if legacy:
+        query = sql.SQL("SELECT {} FROM {} {} ORDER BY {} LIMIT %s OFFSET %s").format(
+            select_list(fields), sql.Identifier(resource["table"]), where_clause(conditions),
+            sql.Identifier(key_column))
+        params += [per_page, (max(page, 1) - 1) * per_page]
+    else:
+        # Fetch one extra row to know whether another page exists
+        query = sql.SQL("SELECT {} FROM {} {} ORDER BY {} LIMIT %s").format(
+            select_list(fields), sql.Identifier(resource["table"]), where_clause(conditions),
+            sql.Identifier(key_column))
+        params.append(per_page + 1)
+
+    if render == "pg":
+        return render_page_in_postgres(key_column, fields, query, params, per_page, legacy, response_format)
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        with metrics.phase("db"):
+            cur.execute(query, params)
+            rows = cur.fetchall()
+        cur.close()
+    metrics.add("rows", len(rows))
+
+    next_cursor = None
+    if not legacy and len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1][fields.index(key_column)])
+
+    if response_format == "columns":
+        body = {"columns": fields, "rows": rows}
+        if not legacy:
+            body["next_cursor"] = next_cursor
+        return jsonify(body)
+    records = [dict(zip(fields, row)) for row in rows]
+    if legacy:
+        return jsonify(records)
+    return jsonify({"data": records, "next_cursor": next_cursor})
+
+
+def render_page_in_postgres(key_column, fields, query, params, per_page, legacy, response_format):
+    """Run a list query with json_agg so the page arrives as one ready-made JSON text.
+
+    The query returns the JSON (cast to text so psycopg2 does not parse
+    it), the last key on the page and the number of rows fetched, which
+    tells whether there is a next page.
+    """
+    key = sql.Identifier(key_column)
+    if response_format == "columns":
+        aggregate = sql.SQL("json_agg(json_build_array({}) ORDER BY {})").format(select_list(fields), key)
+    else:
+        aggregate = sql.SQL("json_agg(shown ORDER BY {})").format(key)
+    wrapped = sql.SQL("""
+        WITH fetched AS ({query}),
+        shown AS (SELECT * FROM fetched ORDER BY {key} LIMIT %s)
+        SELECT
+            (SELECT COALESCE({aggregate}, '[]'::json)::text FROM shown),
+            (SELECT MAX({key}) FROM shown),
+            (SELECT COUNT(*) FROM fetched)
+    """).format(query=query, key=key, aggregate=aggregate)
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        with metrics.phase("db"):
+            cur.execute(wrapped, params + [per_page])
+            rows_json, last_key, fetched = cur.fetchone()
+        cur.close()
+    metrics.add("rows", min(fetched, per_page))
+
+    next_cursor = encode_cursor(last_key) if not legacy and fetched > per_page else None
+    columns = fields if response_format == "columns" else None
+    return Response(pg_page_body(rows_json, columns, next_cursor, legacy, response_format),
+                    mimetype="application/json")
+
+
+def read_json_body():
+    """Parse the request body as JSON, inflating it first when sent with Content-Encoding: gzip."""
+    return decode_json_body(request.get_data(), request.headers.get('Content-Encoding'))
+
+
+def list_view(name):
+    def view():
+        return list_rows(name)
+    return view
+
+
+# One cached GET endpoint per registered resource
+for resource_name, resource in RESOURCES.items():
+    app.add_url_rule(f"/{resource_name}", endpoint=f"list_{resource_name}", methods=['GET'],
+                     view_func=cached_response(resource["table"])(list_view(resource_name)))
+
+
+def aggregate_rows(name):
+    """Return one page of a registered aggregate, grouped and computed by Postgres.
+
+    ``group_by`` picks the grouping, ``start_date``/``end_date`` bound the
+    time window and ``cursor`` pages over the group key as on the list
+    endpoints. The cursor condition sits on a grouping column, so Postgres
+    applies it before aggregating and each page only reads its own groups.
+    """
+    aggregate = AGGREGATES[name]
+    try:
+        group_by, per_page, cursor_token, response_format = parse_aggregate_args(aggregate, request.args)
+        lower, upper = parse_window(request.args)
+        if cursor_token is not None:
+            after = decode_group_cursor(cursor_token, aggregate["group_by"][group_by][1])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    params = []
+    window = []
+    time_column = sql.SQL(aggregate["time_column"])
+    if lower is not None:
+        window.append(sql.SQL("AND {} >= %s").format(time_column))
+        params.append(lower)
+    if upper is not None:
+        window.append(sql.SQL("AND {} < %s").format(time_column))
+        params.append(upper)
+    group = sql.Identifier(group_by)
+    grouped = sql.SQL(aggregate["query"]).format(
+        group=sql.SQL("{} AS {}").format(sql.SQL(aggregate["group_by"][group_by][0]), group),
+        window=sql.SQL(" ").join(window))
+
+    # NULL groups sort first, so a cursor of null means "every non-null group"
+    conditions = []
+    if cursor_token is not None:
+        if after is None:
+            conditions.append(sql.SQL("g.{} IS NOT NULL").format(group))
+        else:
+            conditions.append(sql.SQL("g.{} > %s").format(group))
+            params.append(after)
+    query = sql.SQL("SELECT * FROM ({}) g {} ORDER BY g.{} NULLS FIRST LIMIT %s").format(
+        grouped, where_clause(conditions), group)
+    # Fetch one extra group to know whether another page exists
+    params.append(per_page + 1)
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        with metrics.phase("db"):
+            cur.execute(query, params)
+            rows = cur.fetchall()
+        cur.close()
+    metrics.add("rows", len(rows))
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last_key = rows[-1][0]
+        next_cursor = encode_cursor(last_key.isoformat() if isinstance(last_key, date) else last_key)
+
+    columns = [group_by, *aggregate["columns"]]
+    if response_format == "columns":
+        return jsonify({"columns": columns, "rows": rows, "next_cursor": next_cursor})
+    return jsonify({"data": [dict(zip(columns, row)) for row in rows], "next_cursor": next_cursor})
+
+
+def aggregate_view(name):
+    def view():
+        return aggregate_rows(name)
+    return view
+
+
+# One cached GET /aggregates/<name> endpoint per registered aggregate
+for aggregate_name, aggregate in AGGREGATES.items():
+    app.add_url_rule(f"/aggregates/{aggregate_name}", endpoint=f"aggregate_{aggregate_name}", methods=['GET'],
+                     view_func=cached_response(*aggregate["tables"])(aggregate_view(aggregate_name)))
+
+
+@app.route('/payment_amount', methods=['POST'])
 def insert_payment_amount():
-    if request.method == 'POST':
+    try:
+        try:
+            data = read_json_body()
+        except ValueError as e:
+            logging.error(f"Invalid request body: {e}")
+            return jsonify({"error": str(e)}), 400
+
         try:
-            data = request.get_json()
-            logging.info(f"Received payload: {data}")
-
-            # Validate that the data is wrapped in a JSON object
-            if not isinstance(data, dict) or "data" not in data:
-                logging.error("Payload must be a JSON object with a 'data' key.")
-                return jsonify({"error": "Payload must be a JSON object with a 'data' key"}), 400
-
-            # Extract the list of records from the 'data' key
-            records = data["data"]
-
-            if not isinstance(records, list):
-                logging.error("'data' key must contain a list of JSON objects.")
-                return jsonify({"error": "'data' key must contain a list of JSON objects"}), 400
-
-            # Validate each entry in the list
-            required_fields = {"customer_id", "sum_payment"}
-            for entry in records:
-                if not isinstance(entry, dict):
-                    logging.error(f"Invalid entry: {entry}")
-                    return jsonify({"error": "Each entry in 'data' must be a JSON object"}), 400
-                if not required_fields.issubset(entry.keys()):
-                    logging.error(f"Missing required fields in entry: {entry}")
-                    return jsonify({"error": f"Each entry must include {', '.join(required_fields)}"}), 400
-
-            # Insert data into the database
-            conn = get_db_connection()
+            rows = payment_amount_rows(data)
+        except ValueError as e:
+            logging.error(f"Invalid payload: {e}")
+            return jsonify({"error": str(e)}), 400
+        logging.info(f"Received payload with {len(data['data'])} records.")
+
+        # Insert data into the database in multi-row batches
+        insert_query = """
+            INSERT INTO payment_amount (customer_id, sum_payment)
+            VALUES %s
+            ON CONFLICT (customer_id) DO UPDATE
+            SET sum_payment = EXCLUDED.sum_payment;
+        """
+        started = time.monotonic()
+        with db_connection() as conn:
             cur = conn.cursor()
+            with metrics.phase("db"):
+                execute_values(cur, insert_query, rows, page_size=UPSERT_BATCH_SIZE)
+                conn.commit()
+            cur.close()
+        invalidate(["payment_amount"])
+        elapsed = time.monotonic() - started
+        logging.info(f"Data inserted successfully: {len(rows)} rows in {elapsed:.3f}s "
+                     f"({len(rows) / max(elapsed, 1e-9):.0f} rows/s).")
+        return jsonify({"message": "Data inserted successfully"}), 201
+
+    except Exception as e:
+        logging.error(f"Error processing request: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route('/export/<table>', methods=['GET'])
+def export_table(table):
+    """Stream every row of a table as NDJSON (default) or CSV.
+
+    Rows are read through a named server-side cursor in batches of
+    EXPORT_ITERSIZE and written out as they arrive, so memory stays flat
+    whatever the table size. Accepts the same filters and fields as the
+    list endpoints.
+    """
+    if table not in RESOURCES:
+        return jsonify({"error": f"Unknown table: {table}"}), 404
+    resource = RESOURCES[table]
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ("ndjson", "csv"):
+        return jsonify({"error": "format must be 'ndjson' or 'csv'"}), 400
+    render = request.args.get('render', 'app')
+    if render not in ("app", "pg"):
+        return jsonify({"error": "render must be 'app' or 'pg'"}), 400
+    # Postgres can write each NDJSON line itself; rows are then passed through as text
+    pg_lines = export_format == "ndjson" and render == "pg"
+
+    try:
+        fields = parse_fields(resource, request.args)
+        conditions, params = build_filters(resource)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    selected = sql.SQL("SELECT {} FROM {} {}").format(
+        select_list(fields), sql.Identifier(resource["table"]), where_clause(conditions))
+    if pg_lines:
+        query = sql.SQL("SELECT row_to_json(t)::text FROM ({}) t ORDER BY t.{}").format(
+            selected, sql.Identifier(resource["key"]))
+    else:
+        query = sql.SQL("{} ORDER BY {}").format(selected, sql.Identifier(resource["key"]))
+
+    def generate():
+        with db_connection() as conn:
+            cur = conn.cursor(name=f"export_{table}")
+            cur.itersize = EXPORT_ITERSIZE
+            cur.execute(query, params)
+            columns = None
+            exported = 0
+            while True:
+                rows = cur.fetchmany(EXPORT_ITERSIZE)
+                if columns is None:
+                    columns = [desc[0] for desc in cur.description]
+                    if export_format == "csv":
+                        yield _csv_lines([columns])
+                if not rows:
+                    break
+                exported += len(rows)
+                if export_format == "csv":
+                    yield _csv_lines(rows)
+                elif pg_lines:
+                    yield "".join(row[0] + "\n" for row in rows)
+                else:
+                    yield "".join(app.json.dumps(dict(zip(columns, row))) + "\n" for row in rows)
+            cur.close()
+        # The response has been sent by now, so rows are counted per table rather than per request
+        metrics.EXPORT_ROWS.inc(exported, table=table)
+        logging.info(f"Exported {exported} rows from {table}.")
 
-            insert_query = """
-                INSERT INTO payment_amount (customer_id, sum_payment)
-                VALUES (%s, %s)
-                ON CONFLICT (customer_id) DO UPDATE
-                SET sum_payment = EXCLUDED.sum_payment;
-            """
-            for entry in records:
-                cur.execute(insert_query, (entry["customer_id"], entry["sum_payment"]))
+    mimetype = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
 
-            conn.commit()
-            cur.close()
-            conn.close()
-            logging.info("Data inserted successfully.")
-            return jsonify({"message": "Data inserted successfully"}), 201
 
-        except Exception as e:
-            logging.error(f"Error processing request: {e}")
-            return jsonify({"error": "Internal server error"}), 500
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
 
 
-    elif request.method == 'GET':
+@app.route('/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    """Drop cached responses after writes made outside the API, e.g. by the ETL.
 
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
-        offset = (page - 1) * per_page
+    Accepts an optional {"tables": [...]} body; without it every cached table is invalidated.
+    """
+    body = request.get_json(silent=True) or {}
+    tables = body.get("tables")
+    if tables is not None and (not isinstance(tables, list) or not all(isinstance(t, str) for t in tables)):
+        return jsonify({"error": "'tables' must be a list of table names"}), 400
+    return jsonify({"invalidated": invalidate(tables)})
 
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM payment_amount LIMIT %s OFFSET %s", (per_page, offset))
-        columns = [desc[0] for desc in cur.description]
-        payment_amount_data = []
-        for row in cur.fetchall():
-            usage = dict(zip(columns, row))
-            payment_amount_data.append(usage)
 
-        cur.close()
-        conn.close()
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(cache_stats())
+
+
+@app.before_request
+def start_request_metrics():
+    metrics.start_request()
+
+
+@app.after_request
+def record_request_metrics(response):
+    # Endpoint names are fixed by the routes, which keeps the label set bounded
+    metrics.finish_request(request.endpoint or "unmatched", request.method, response.status_code)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Request latency, query/serialization time, row and pool metrics in the Prometheus text format."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.errorhandler(PoolError)
+def handle_pool_exhausted(e):
+    logging.error(f"Database pool exhausted: {e}")
+    return jsonify({"error": "Database busy, try again later"}), 503
+
+@app.route('/pool_stats', methods=['GET'])
+def get_pool_stats():
+    return jsonify(pool_stats())
+
+def prepare_database():
+    """Apply pending migrations and seed a fresh database; run once before serving."""
+    migrate()
+    # Seed only a fresh database so restarts do not duplicate data
+    if is_empty():
+        insert_data_to_db()
+        refresh_usage_summary(concurrently=False)
 
-        return jsonify(payment_amount_data)
 
 if __name__ == "__main__":
-    create_tables()
-    insert_data_to_db()
+    # Development server; production runs under gunicorn (see gunicorn.conf.py)
+    prepare_database()
     app.run(debug=True, host="0.0.0.0", port=5001)
@@ -0,0 +1,289 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+import aiohttp
+import asyncpg
+from aiohttp import web
+
+from api_common import (
+    MAX_REQUEST_BYTES, RESOURCES, UPSERT_BATCH_SIZE, decode_cursor, decode_json_body, encode_cursor, parse_fields,
+    parse_filters, parse_page_args, payment_amount_rows, pg_page_body,
+)
+from db_utils import POOL_TIMEOUT, SCHEMA_VERSION, db_params, migrate
+from fast_json import dumps_bytes
+import metrics
+from response_cache import CACHE_URL, invalidate
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# asyncio variant of the read API in app.py: same routes, parameters and
+# response bodies, served from one event loop over an asyncpg pool.
+
+ASYNC_API_HOST = os.getenv('ASYNC_API_HOST', '0.0.0.0')
+ASYNC_API_PORT = int(os.getenv('ASYNC_API_PORT', '5002'))
+# Connections are only held while a query runs, so a small pool serves many open client connections
+ASYNC_POOL_MIN_SIZE = int(os.getenv('ASYNC_POOL_MIN_SIZE', '2'))
+ASYNC_POOL_MAX_SIZE = int(os.getenv('ASYNC_POOL_MAX_SIZE', '20'))
+# Seconds in-flight requests get to finish after SIGTERM
+ASYNC_SHUTDOWN_TIMEOUT = float(os.getenv('ASYNC_SHUTDOWN_TIMEOUT', '30'))
+# Flask API endpoint that drops its cached responses; used for writes when no shared API_CACHE_URL is set
+API_CACHE_INVALIDATE_URL = os.getenv('API_CACHE_INVALIDATE_URL', 'http://flask-app:5001/cache/invalidate')
+# Seconds to wait for the Flask API to confirm an invalidation
+API_CACHE_INVALIDATE_TIMEOUT = float(os.getenv('API_CACHE_INVALIDATE_TIMEOUT', '2'))
+
+UPSERT_SQL = """
+    INSERT INTO payment_amount (customer_id, sum_payment)
+    SELECT customer_id::int, sum_payment::numeric
+    FROM unnest($1::text[], $2::text[]) AS t (customer_id, sum_payment)
+    ON CONFLICT (customer_id) DO UPDATE
+    SET sum_payment = EXCLUDED.sum_payment;
+"""
+
+
+def json_response(obj, status=200):
+    # Same bytes as jsonify outside debug mode
+    with metrics.phase("serialize"):
+        body = dumps_bytes(obj) + b"\n"
+    return web.Response(body=body, status=status, content_type="application/json")
+
+
+async def invalidate_api_cache(tables):
+    """Drop the Flask API's cached responses for tables this process just wrote.
+
+    With a shared API_CACHE_URL the generations are bumped in Redis directly;
+    otherwise the Flask API is asked over HTTP, since its cache lives in
+    another process. Best effort: a failure is logged and the cache TTL
+    bounds how long stale responses can be served.
+    """
+    if CACHE_URL:
+        # The cache client is blocking, so keep it off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, invalidate, tables)
+        return
+    if not API_CACHE_INVALIDATE_URL:
+        return
+    try:
+        timeout = aiohttp.ClientTimeout(total=API_CACHE_INVALIDATE_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.post(API_CACHE_INVALIDATE_URL, json={"tables": list(tables)}) as response:
+                response.raise_for_status()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logging.warning(f"Could not invalidate API cache for {', '.join(tables)}: {e}")
+
+
+@asynccontextmanager
+async def acquire(app):
+    """Borrow a pooled connection, answering 503 when none frees up within POOL_TIMEOUT."""
+    pool = app["pool"]
+    started = time.monotonic()
+    try:
+        conn = await pool.acquire(timeout=POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        metrics.POOL_TIMEOUTS.inc()
+        metrics.add("pool_wait", time.monotonic() - started)
+        logging.error(f"Database pool exhausted: no connection within {POOL_TIMEOUT}s")
+        raise web.HTTPServiceUnavailable(body=dumps_bytes({"error": "Database busy, try again later"}) + b"\n",
+                                         content_type="application/json")
+    waited = time.monotonic() - started
+    metrics.POOL_WAIT.observe(waited)
+    metrics.add("pool_wait", waited)
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+
+def quoted_list(columns):
+    # Column names come from the resource registry, never from the request
+    return ", ".join(f'"{column}"' for column in columns)
+
+
+def where_clause(conditions, params):
+    """Render shared filter conditions with asyncpg's $n placeholders, appending their values to params."""
+    parts = []
+    for column, operator, value, pg_type in conditions:
+        params.append(value)
+        parts.append(f'"{column}" {operator} ${len(params)}::{pg_type}')
+    return f"WHERE {' AND '.join(parts)}" if parts else ""
+
+
+async def list_rows(request, name):
+    """Return one page of a registered resource, exactly as app.list_rows does."""
+    resource = RESOURCES[name]
+    key_column = resource["key"]
+    try:
+        per_page, page, cursor_token, legacy, response_format, render = parse_page_args(request.query)
+        fields = parse_fields(resource, request.query)
+        conditions = parse_filters(resource, request.query)
+        if cursor_token:
+            conditions.append((key_column, ">", decode_cursor(cursor_token), "bigint"))
+    except ValueError as e:
+        return json_response({"error": str(e)}, status=400)
+
+    params = []
+    where = where_clause(conditions, params)
+    select = f"SELECT {quoted_list(fields)}"
+    if legacy:
+        params += [per_page, (max(page, 1) - 1) * per_page]
+        query = (f'{select} FROM "{resource["table"]}" {where} ORDER BY "{key_column}" '
+                 f'LIMIT ${len(params) - 1} OFFSET ${len(params)}')
+    else:
+        # Fetch one extra row to know whether another page exists
+        params.append(per_page + 1)
+        query = f'{select} FROM "{resource["table"]}" {where} ORDER BY "{key_column}" LIMIT ${len(params)}'
+
+    if render == "pg":
+        return await render_page_in_postgres(request.app, key_column, fields, query, params, per_page, legacy,
+                                             response_format)
+
+    async with acquire(request.app) as conn:
+        with metrics.phase("db"):
+            records = await conn.fetch(query, *params)
+    metrics.add("rows", len(records))
+
+    next_cursor = None
+    if not legacy and len(records) > per_page:
+        records = records[:per_page]
+        next_cursor = encode_cursor(records[-1][key_column])
+
+    if response_format == "columns":
+        body = {"columns": fields, "rows": [tuple(record) for record in records]}
+        if not legacy:
+            body["next_cursor"] = next_cursor
+        return json_response(body)
+    rows = [dict(record) for record in records]
+    if legacy:
+        return json_response(rows)
+    return json_response({"data": rows, "next_cursor": next_cursor})
+
+
+async def render_page_in_postgres(app, key_column, fields, query, params, per_page, legacy, response_format):
+    """Have Postgres build the page with json_agg and pass its text through, as in app.py."""
+    if response_format == "columns":
+        aggregate = f'json_agg(json_build_array({quoted_list(fields)}) ORDER BY "{key_column}")'
+    else:
+        aggregate = f'json_agg(shown ORDER BY "{key_column}")'
+    wrapped = f"""
+        WITH fetched AS ({query}),
+        shown AS (SELECT * FROM fetched ORDER BY "{key_column}" LIMIT ${len(params) + 1})
+        SELECT
+            (SELECT COALESCE({aggregate}, '[]'::json)::text FROM shown),
+            (SELECT MAX("{key_column}") FROM shown),
+            (SELECT COUNT(*) FROM fetched)
+    """
+    async with acquire(app) as conn:
+        with metrics.phase("db"):
+            rows_json, last_key, fetched = await conn.fetchrow(wrapped, *params, per_page)
+    metrics.add("rows", min(fetched, per_page))
+
+    next_cursor = encode_cursor(last_key) if not legacy and fetched > per_page else None
+    columns = fields if response_format == "columns" else None
+    return web.Response(text=pg_page_body(rows_json, columns, next_cursor, legacy, response_format),
+                        content_type="application/json")
+
+
+def list_handler(name):
+    async def handler(request):
+        return await list_rows(request, name)
+    return handler
+
+
+async def insert_payment_amount(request):
+    try:
+        try:
+            data = decode_json_body(await request.read(), request.headers.get('Content-Encoding'))
+        except ValueError as e:
+            logging.error(f"Invalid request body: {e}")
+            return json_response({"error": str(e)}, status=400)
+        try:
+            rows = payment_amount_rows(data)
+        except ValueError as e:
+            logging.error(f"Invalid payload: {e}")
+            return json_response({"error": str(e)}, status=400)
+        logging.info(f"Received payload with {len(data['data'])} records.")
+
+        # Values are sent as text and cast by Postgres, like psycopg2's literals
+        started = time.monotonic()
+        async with acquire(request.app) as conn:
+            with metrics.phase("db"):
+                async with conn.transaction():
+                    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+                        batch = rows[start:start + UPSERT_BATCH_SIZE]
+                        await conn.execute(
+                            UPSERT_SQL,
+                            [None if customer_id is None else str(customer_id) for customer_id, _ in batch],
+                            [None if sum_payment is None else str(sum_payment) for _, sum_payment in batch],
+                        )
+        await invalidate_api_cache(["payment_amount"])
+        elapsed = time.monotonic() - started
+        logging.info(f"Data inserted successfully: {len(rows)} rows in {elapsed:.3f}s "
+                     f"({len(rows) / max(elapsed, 1e-9):.0f} rows/s).")
+        return json_response({"message": "Data inserted successfully"}, status=201)
+    except web.HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error processing request: {e}")
+        return json_response({"error": "Internal server error"}, status=500)
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    """Record each request's latency and phase timings, labelled like the Flask endpoints."""
+    metrics.start_request()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        metrics.finish_request(request.match_info.route.name or "unmatched", request.method, status)
+
+
+async def get_metrics(request):
+    return web.Response(body=metrics.render().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def open_pool(app):
+    app["pool"] = await asyncpg.create_pool(
+        host=db_params['host'], port=int(db_params['port']), database=db_params['dbname'],
+        user=db_params['user'], password=db_params['password'],
+        min_size=ASYNC_POOL_MIN_SIZE, max_size=ASYNC_POOL_MAX_SIZE,
+    )
+    version = await app["pool"].fetchval(
+        "SELECT CASE WHEN to_regclass('schema_version') IS NULL THEN 0 "
+        "ELSE (SELECT COALESCE(MAX(version), 0) FROM schema_version) END")
+    if version < SCHEMA_VERSION:
+        await app["pool"].close()
+        raise RuntimeError(f"Database schema is at version {version}, expected {SCHEMA_VERSION}")
+    logging.info(f"asyncpg pool ready (min={ASYNC_POOL_MIN_SIZE}, max={ASYNC_POOL_MAX_SIZE}, "
+                 f"schema version {version}).")
+
+
+async def close_pool(app):
+    # Waits for connections still held by in-flight requests to be released
+    await app["pool"].close()
+    logging.info("asyncpg pool closed.")
+
+
+def create_app():
+    # Bodies are inflated by decode_json_body, which caps the decompressed size
+    app = web.Application(client_max_size=MAX_REQUEST_BYTES, handler_args={"auto_decompress": False},
+                          middlewares=[metrics_middleware])
+    app.on_startup.append(open_pool)
+    app.on_cleanup.append(close_pool)
+    for name in RESOURCES:
+        app.router.add_get(f"/{name}", list_handler(name), name=f"list_{name}")
+    app.router.add_post('/payment_amount', insert_payment_amount, name="insert_payment_amount")
+    app.router.add_get('/metrics', get_metrics, name="get_metrics")
+    return app
+
+
+if __name__ == "__main__":
+    migrate()
+    web.run_app(create_app(), host=ASYNC_API_HOST, port=ASYNC_API_PORT, shutdown_timeout=ASYNC_SHUTDOWN_TIMEOUT)
@@ -73,8 +73,48 @@ with DAG(
     max_active_runs=1,
 ) as etl_dag:
 
-    # Task: Run full etl_pipeline.py
+    # Task: Apply the day's new payments to payment_amount inside Postgres
     full_etl_task = BashOperator(
         task_id="run_full_etl",
-        bash_command="python /opt/airflow/dags/utils/etl_pipeline.py",
+        bash_command="python /opt/airflow/dags/utils/etl_pipeline.py incremental",
+    )
+
+    # Task: Refresh the usage_summary materialized view read by avg_usage and /usage_summary
+    refresh_usage_summary_task = BashOperator(
+        task_id="refresh_usage_summary",
+        bash_command="python /opt/airflow/dags/utils/etl_pipeline.py refresh-usage-summary",
+    )
+
+# DAG 3: Weekly full rebuild of payment_amount to reconcile the incremental totals
+with DAG(
+    dag_id="payment_amount_rebuild_dag",
+    default_args=default_args,
+    description="Recompute payment_amount from all payments weekly",
+    schedule_interval="0 2 * * 0",  # Sundays at 02:00
+    start_date=datetime(2025, 1, 1),
+    catchup=False,
+    max_active_runs=1,
+) as rebuild_dag:
+
+    # Task: Full recomputation as a single statement inside Postgres
+    rebuild_task = BashOperator(
+        task_id="rebuild_payment_amount",
+        bash_command="python /opt/airflow/dags/utils/etl_pipeline.py pushdown",
+    )
+
+# DAG 4: Monthly partition maintenance, so payments and usage never fall back to the default partition
+with DAG(
+    dag_id="partition_maintenance_dag",
+    default_args=default_args,
+    description="Create upcoming monthly partitions of payments and usage",
+    schedule_interval="0 3 1 * *",  # First day of every month at 03:00
+    start_date=datetime(2025, 1, 1),
+    catchup=False,
+    max_active_runs=1,
+) as partition_dag:
+
+    # Task: Create partitions DB_PARTITION_MONTHS_AHEAD months ahead and move stranded rows out of the default
+    ensure_partitions_task = BashOperator(
+        task_id="ensure_partitions",
+        bash_command="cd /opt/airflow/app && python db_utils.py --ensure-partitions",
     )
@@ -0,0 +1,155 @@
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from landing_zone import iter_column_batches, require_baseline
+from vectorized_transform import join_keys, to_array, landed_column
+
+# Approximate memory allowed for in-memory partial aggregates before they spill to disk
+MEMORY_BUDGET_BYTES = int(os.getenv("CHUNK_MEMORY_BUDGET_MB", 256)) * 1024 * 1024
+# Number of hash partitions spilled partials are split into; each is merged on its own
+SPILL_PARTITIONS = int(os.getenv("CHUNK_SPILL_PARTITIONS", 16))
+
+
+def _combine(keys, sums, counts):
+    """Merge partial aggregates that share keys: sums and counts add up."""
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    merged_sums = {
+        column: np.bincount(inverse, weights=values, minlength=unique_keys.size)
+        for column, values in sums.items()
+    }
+    merged_counts = np.bincount(inverse, weights=counts, minlength=unique_keys.size).astype(np.int64)
+    return unique_keys, merged_sums, merged_counts
+
+
+class SpillingAggregator:
+    """Per-key sums and counts over batches, spilling partials to disk past a memory budget.
+
+    Each batch is reduced to one partial row per key before it is kept, so
+    memory is bounded by the number of distinct keys held at once. When
+    that exceeds the budget the partials are written to hash-partitioned
+    spill files. results() then merges one partition at a time, folding its
+    spill files in one by one, so peak memory is one partition's distinct
+    keys plus one spill file, however many spills there were.
+    """
+
+    def __init__(self, columns, memory_budget=MEMORY_BUDGET_BYTES, partitions=SPILL_PARTITIONS):
+        self.columns = list(columns)
+        self.memory_budget = memory_budget
+        self.partitions = partitions
+        self._partials = []
+        self._held_keys = 0
+        self._spill_dir = None
+        self._spills = 0
+
+    def _bytes_per_key(self):
+        return 8 * (len(self.columns) + 2)
+
+    def add(self, keys, values):
+        """Add a batch: keys is an int array, values maps each column to an array of the same length."""
+        if keys.size == 0:
+            return
+        sums = {column: np.asarray(values[column], dtype=np.float64) for column in self.columns}
+        partial = _combine(keys, sums, np.ones(keys.size, dtype=np.int64))
+        self._partials.append(partial)
+        self._held_keys += partial[0].size
+        if self._held_keys * self._bytes_per_key() > self.memory_budget:
+            self._compact()
+            if self._held_keys * self._bytes_per_key() > self.memory_budget:
+                self._spill()
+
+    def _merged_partials(self):
+        keys = np.concatenate([partial[0] for partial in self._partials])
+        sums = {column: np.concatenate([partial[1][column] for partial in self._partials]) for column in self.columns}
+        counts = np.concatenate([partial[2] for partial in self._partials])
+        return _combine(keys, sums, counts)
+
+    def _compact(self):
+        if len(self._partials) > 1:
+            self._partials = [self._merged_partials()]
+            self._held_keys = self._partials[0][0].size
+
+    def _spill(self):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="etl_spill_")
+        keys, sums, counts = self._partials[0]
+        partition_of = keys % self.partitions
+        for partition in range(self.partitions):
+            mask = partition_of == partition
+            if mask.any():
+                path = os.path.join(self._spill_dir, f"p{partition:03d}-{self._spills:05d}.npz")
+                np.savez(path, keys=keys[mask], counts=counts[mask],
+                         **{f"sum_{column}": sums[column][mask] for column in self.columns})
+        logging.info(f"Spilled {keys.size} partial aggregates to {self._spill_dir} (spill #{self._spills}).")
+        self._spills += 1
+        self._partials = []
+        self._held_keys = 0
+
+    def results(self):
+        """Yield (keys, sums, counts) per partition, with keys sorted within each partition."""
+        try:
+            if self._spill_dir is None:
+                if self._partials:
+                    yield self._merged_partials()
+                return
+            if self._partials:
+                self._compact()
+                self._spill()
+            names = sorted(os.listdir(self._spill_dir))
+            for partition in range(self.partitions):
+                merged = None
+                for name in names:
+                    if not name.startswith(f"p{partition:03d}-"):
+                        continue
+                    path = os.path.join(self._spill_dir, name)
+                    with np.load(path) as data:
+                        part = (data["keys"], {column: data[f"sum_{column}"] for column in self.columns},
+                                data["counts"])
+                    os.remove(path)
+                    # Compact after every file so only the merged partition and one spill are held
+                    self._partials = [part] if merged is None else [merged, part]
+                    merged = self._merged_partials()
+                self._partials = []
+                if merged is not None:
+                    yield merged
+        finally:
+            if self._spill_dir is not None:
+                shutil.rmtree(self._spill_dir, ignore_errors=True)
+                self._spill_dir = None
+
+
+def _subscription_customers():
+    subscription_ids = landed_column("subscriptions", "subscription_id", np.int64)
+    customer_ids = landed_column("subscriptions", "customer_id", np.int64)
+    return subscription_ids, customer_ids
+
+
+def chunked_payment_totals():
+    """Yield [{"customer_id", "sum_payment"}] batches from landed payments, one batch at a time.
+
+    Only the subscription -> customer map is held in full; payments are
+    aggregated per landed batch and merged through a SpillingAggregator.
+    Every customer with a subscription gets a total, 0 if it has no
+    payments, like the SQL transform. Requires full landed baselines of
+    subscriptions and payments.
+    """
+    require_baseline(["subscriptions", "payments"])
+    subscription_ids, customer_ids = _subscription_customers()
+    aggregator = SpillingAggregator(["amount_cents"])
+    # A zero for every customer, so those without payments come out with a total of 0
+    subscribed_customers = np.unique(customer_ids)
+    aggregator.add(subscribed_customers, {"amount_cents": np.zeros(subscribed_customers.size)})
+    for batch in iter_column_batches("payments", ["subscription_id", "amount"]):
+        payment_customer_ids, matched = join_keys(
+            subscription_ids, customer_ids, to_array(batch["subscription_id"], np.int64))
+        cents = np.rint(to_array(batch["amount"], np.float64) * 100)[matched]
+        aggregator.add(payment_customer_ids, {"amount_cents": cents})
+    for keys, sums, _ in aggregator.results():
+        yield [
+            {"customer_id": customer_id, "sum_payment": round(total / 100, 2)}
+            for customer_id, total in zip(keys.tolist(), sums["amount_cents"].tolist())
+        ]
+
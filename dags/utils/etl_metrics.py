@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-stage timings and row counts of an ETL run. Each stage is logged as a
+# JSON line when it ends, and the run's totals are written in the Prometheus
+# text format for node_exporter's textfile collector to pick up.
+
+# One <mode>.prom file per pipeline mode, so runs of different tasks do not overwrite each other
+ETL_METRICS_DIR = os.getenv("ETL_METRICS_DIR",
+                            os.path.join(os.getenv("ETL_DATA_DIR", "/opt/airflow/data"), "metrics"))
+
+# stage -> {"seconds", "rows", "calls", "errors"}, summed over the run
+_stages = {}
+_stages_lock = threading.Lock()
+
+
+@contextmanager
+def stage(name, **fields):
+    """Time one ETL stage (extract, transform, load_db, ...).
+
+    Yields a dict; set its "rows" to the number of rows the stage handled.
+    Extra fields, such as the table, are added to the JSON log line.
+    """
+    result = {"rows": 0}
+    started = time.monotonic()
+    status = "error"
+    try:
+        yield result
+        status = "ok"
+    finally:
+        elapsed = time.monotonic() - started
+        with _stages_lock:
+            totals = _stages.setdefault(name, {"seconds": 0.0, "rows": 0, "calls": 0, "errors": 0})
+            totals["seconds"] += elapsed
+            totals["rows"] += result["rows"]
+            totals["calls"] += 1
+            totals["errors"] += status == "error"
+        logging.info(json.dumps({
+            "event": "etl_stage",
+            "stage": name,
+            "status": status,
+            "duration_seconds": round(elapsed, 6),
+            "rows": result["rows"],
+            **fields,
+        }))
+
+
+def write_run_metrics(mode, succeeded, duration):
+    """Log the run summary and write its metrics to ETL_METRICS_DIR/etl_<mode>.prom atomically."""
+    with _stages_lock:
+        stages = {name: {**totals, "seconds": round(totals["seconds"], 6)} for name, totals in _stages.items()}
+    logging.info(json.dumps({
+        "event": "etl_run",
+        "mode": mode,
+        "status": "ok" if succeeded else "error",
+        "duration_seconds": round(duration, 6),
+        "stages": stages,
+    }))
+
+    lines = [
+        "# HELP etl_run_duration_seconds Wall time of the last ETL run.",
+        "# TYPE etl_run_duration_seconds gauge",
+        f'etl_run_duration_seconds{{mode="{mode}"}} {duration:.6f}',
+        "# HELP etl_run_success Whether the last ETL run succeeded (1) or failed (0).",
+        "# TYPE etl_run_success gauge",
+        f'etl_run_success{{mode="{mode}"}} {int(succeeded)}',
+        "# HELP etl_run_completed_timestamp_seconds When the last ETL run ended, in Unix time.",
+        "# TYPE etl_run_completed_timestamp_seconds gauge",
+        f'etl_run_completed_timestamp_seconds{{mode="{mode}"}} {time.time():.3f}',
+    ]
+    for metric, key, description in (
+        ("etl_stage_duration_seconds", "seconds", "Time spent in each stage during the last run."),
+        ("etl_stage_rows", "rows", "Rows handled by each stage during the last run."),
+        ("etl_stage_calls", "calls", "Times each stage ran during the last run (batches, tables, chunks)."),
+        ("etl_stage_errors", "errors", "Stage calls that raised during the last run."),
+    ):
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} gauge")
+        for name, totals in sorted(stages.items()):
+            value = f"{totals[key]:.6f}" if key == "seconds" else totals[key]
+            lines.append(f'{metric}{{mode="{mode}",stage="{name}"}} {value}')
+
+    path = os.path.join(ETL_METRICS_DIR, f"etl_{mode}.prom")
+    try:
+        os.makedirs(ETL_METRICS_DIR, exist_ok=True)
+        # The collector must never read a half-written file
+        with open(f"{path}.tmp", "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        logging.warning(f"Could not write ETL metrics to {path}: {e}")
@@ -1,11 +1,21 @@
 import requests
 import psycopg2
+from psycopg2.extras import execute_values
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import gzip
+import io
+import json
 import logging
+import time
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import os
 import sys
 
+from etl_metrics import stage, write_run_metrics
+from landing_zone import has_baseline, high_water_mark, land_rows, landed_keys
+
 # Load environment variables
 load_dotenv()
 
@@ -18,6 +28,59 @@ DB_CONFIG = {
     "password": os.getenv("POSTGRES_PASSWORD", "postgres"),
 }
 
+# Flask API serving the source tables
+API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:5001")
+# Seconds to wait for the API to connect / to send the next streamed chunk
+API_TIMEOUT = (10, int(os.getenv("API_READ_TIMEOUT", 300)))
+
+# Local working directory for landed data
+ETL_DATA_DIR = os.getenv("ETL_DATA_DIR", "/opt/airflow/data")
+
+# Source tables pulled by the extract mode and their primary key columns
+EXTRACT_TABLES = {
+    "customers": "customer_id",
+    "subscriptions": "subscription_id",
+    "payments": "payment_id",
+    "usage": "usage_id",
+}
+
+# Parallel table extracts and attempts per extract request
+EXTRACT_CONCURRENCY = int(os.getenv("EXTRACT_CONCURRENCY", 4))
+EXTRACT_RETRIES = int(os.getenv("EXTRACT_RETRIES", 3))
+# Keys below the high-water mark that are re-read on every extract. Serial keys are assigned at
+# insert, not commit, so a transaction committing late can add a row below rows already landed
+EXTRACT_OVERLAP_KEYS = int(os.getenv("EXTRACT_OVERLAP_KEYS", 1000))
+
+# Payment and subscription ids below the incremental watermark that are re-scanned on every run. Serial
+# ids are assigned at insert, not commit, so a payment committing late can appear below the watermark
+INCREMENTAL_OVERLAP_IDS = int(os.getenv("INCREMENTAL_OVERLAP_IDS", 1000))
+
+# Total payments per customer with a subscription, 0 without payments: the transform step
+# shared by the full, chunked and pushdown modes
+PAYMENT_TOTALS_SQL = """
+    SELECT
+        s.customer_id,
+        COALESCE(SUM(p.amount), 0) AS sum_payment
+    FROM
+        subscriptions s
+    LEFT JOIN
+        payments p ON s.subscription_id = p.subscription_id
+    GROUP BY
+        s.customer_id
+"""
+
+# Records per batch read by the chunked transform
+TRANSFORM_BATCH_SIZE = int(os.getenv("TRANSFORM_BATCH_SIZE", 50000))
+
+# Batch size and strategy ("values" or "copy") used by load_data_to_db
+LOAD_BATCH_SIZE = int(os.getenv("LOAD_BATCH_SIZE", 10000))
+LOAD_METHOD = os.getenv("LOAD_METHOD", "values")
+
+# Chunking, concurrency and retries used by load_data_to_api
+API_LOAD_CHUNK_SIZE = int(os.getenv("API_LOAD_CHUNK_SIZE", 5000))
+API_LOAD_CONCURRENCY = int(os.getenv("API_LOAD_CONCURRENCY", 4))
+API_LOAD_RETRIES = int(os.getenv("API_LOAD_RETRIES", 3))
+
 # Logging configuration
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
@@ -33,20 +96,34 @@ def get_db_connection():
 
 
 def change_db_schema():
-    """Modify the database schema to add a unique constraint on customer_id."""
-    alter_query = """
-        ALTER TABLE payment_amount ADD CONSTRAINT unique_customer_id UNIQUE (customer_id);
+    """Make sure payment_amount has the unique customer_id constraint the upserts rely on.
+
+    The constraint normally comes from the app's migrations (db_utils.migrate);
+    this only checks for it, and builds it the same way (a concurrent unique
+    index promoted to a constraint) if the ETL runs against an unmigrated
+    database. Safe to call on every run.
     """
     try:
         conn = get_db_connection()
+        conn.autocommit = True
         cur = conn.cursor()
-        cur.execute(alter_query)
-        conn.commit()
+        cur.execute("SELECT 1 FROM pg_constraint WHERE conname = 'unique_customer_id'")
+        if cur.fetchone():
+            logging.info("Database schema already has unique_customer_id.")
+        else:
+            cur.execute("""
+                DELETE FROM payment_amount older USING payment_amount newer
+                WHERE older.customer_id = newer.customer_id AND older.id < newer.id;
+            """)
+            cur.execute("DROP INDEX CONCURRENTLY IF EXISTS unique_customer_id;")
+            cur.execute("CREATE UNIQUE INDEX CONCURRENTLY unique_customer_id ON payment_amount (customer_id);")
+            cur.execute("ALTER TABLE payment_amount ADD CONSTRAINT unique_customer_id UNIQUE USING INDEX unique_customer_id;")
+            logging.info("Database schema successfully changed!")
         cur.close()
         conn.close()
-        logging.info("Database schema successfully changed!")
     except Exception as e:
         logging.error(f"Failed to change database schema: {e}")
+        raise
 
 
 def extract_data(api_endpoint, days=30):
@@ -71,113 +148,653 @@ def extract_data(api_endpoint, days=30):
         raise
 
 
+def api_session(pool_size):
+    """Return a requests.Session whose keep-alive pool can serve pool_size concurrent requests."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def invalidate_api_cache(tables):
+    """Tell the API to drop cached responses for tables the ETL just wrote.
+
+    Best effort: a failure is logged, and the API's cache TTL bounds how
+    long stale responses can be served.
+    """
+    try:
+        response = requests.post(f"{API_BASE_URL}/cache/invalidate", json={"tables": list(tables)},
+                                 timeout=API_TIMEOUT)
+        response.raise_for_status()
+        logging.info(f"Invalidated API cache for {', '.join(tables)}.")
+    except requests.RequestException as e:
+        logging.warning(f"Could not invalidate API cache for {', '.join(tables)}: {e}")
+
+
+def _is_retryable(error):
+    response = getattr(error, "response", None)
+    return response is None or response.status_code >= 500 or response.status_code == 429
+
+
+def with_retries(action, description, retries):
+    """Call action(), retrying transient HTTP failures with exponential backoff."""
+    for attempt in range(1, retries + 1):
+        try:
+            return action()
+        except requests.RequestException as e:
+            if attempt == retries or not _is_retryable(e):
+                raise
+            delay = 2 ** (attempt - 1)
+            logging.warning(f"{description} failed (attempt {attempt}/{retries}): {e}; retrying in {delay}s")
+            time.sleep(delay)
+
+
+def extract_table(table, filters=None, session=None, consume=list):
+    """Stream a snapshot of a table from the API's /export endpoint into consume(rows).
+
+    rows iterates over the NDJSON response as it arrives, so consume
+    decides how much is held in memory; the default collects a list. A
+    transient failure retries the request and consume together, so
+    consume must leave nothing behind when it raises, as land_rows does.
+    Returns (consume's result, rows streamed).
+    """
+    api_endpoint = f"{API_BASE_URL}/export/{table}"
+    params = {"format": "ndjson", **(filters or {})}
+    http = session or requests
+    streamed = {"rows": 0}
+
+    def fetch():
+        streamed["rows"] = 0
+        with http.get(api_endpoint, params=params, stream=True, timeout=API_TIMEOUT) as response:
+            response.raise_for_status()
+
+            def rows():
+                for line in response.iter_lines():
+                    if line:
+                        streamed["rows"] += 1
+                        yield json.loads(line)
+
+            return consume(rows())
+
+    try:
+        logging.info(f"Extracting {table} from {api_endpoint} with filters {filters or {}}...")
+        started = time.monotonic()
+        with stage("extract", table=table) as result:
+            consumed = with_retries(fetch, f"Export of {table}", EXTRACT_RETRIES)
+            result["rows"] = streamed["rows"]
+        logging.info(f"Extracted {streamed['rows']} rows from {table} in {time.monotonic() - started:.2f}s.")
+        return consumed, streamed["rows"]
+    except Exception as e:
+        logging.error(f"Failed to export {table} from {api_endpoint}: {e}")
+        raise
+
+
+def extract_aggregate(name, params=None, session=None):
+    """Fetch every group of a server-side aggregate, following next_cursor page by page.
+
+    The grouping is done by Postgres behind GET /aggregates/<name>, so only
+    one row per group crosses the network instead of the raw rows.
+    """
+    api_endpoint = f"{API_BASE_URL}/aggregates/{name}"
+    params = {"per_page": 1000, **(params or {})}
+    http = session or requests
+    rows = []
+    try:
+        logging.info(f"Fetching aggregate {name} with {params}...")
+        started = time.monotonic()
+        with stage("extract", aggregate=name) as result:
+            while True:
+                def fetch():
+                    response = http.get(api_endpoint, params=params, timeout=API_TIMEOUT)
+                    response.raise_for_status()
+                    return response.json()
+
+                page = with_retries(fetch, f"Aggregate {name}", EXTRACT_RETRIES)
+                rows.extend(page["data"])
+                if page["next_cursor"] is None:
+                    break
+                params["cursor"] = page["next_cursor"]
+            result["rows"] = len(rows)
+        logging.info(f"Fetched {len(rows)} {name} groups in {time.monotonic() - started:.2f}s.")
+        return rows
+    except Exception as e:
+        logging.error(f"Failed to fetch aggregate {name} from {api_endpoint}: {e}")
+        raise
+
+
+def extract_incremental(table, session=None):
+    """Extract only the rows of a table added since the last successful run.
+
+    The source tables are append-only with serial keys, so the largest key
+    landed so far is the high-water mark. It is read back from the landing
+    manifest, which lists a file only once the file is in place. Serial
+    keys are handed out before commit, so a row can appear below the mark
+    after a later row was landed: each run re-reads EXTRACT_OVERLAP_KEYS
+    keys below the mark and lands only the rows whose keys are not landed
+    yet. Until a full extract has been landed (has_baseline), the whole
+    table is extracted without filters and landed as its baseline, so the
+    landing zone always holds complete history for the landing transforms.
+    Rows are streamed from the API straight into the local landing zone
+    (see landing_zone.py). Returns the number of new rows landed.
+    """
+    key_column = EXTRACT_TABLES[table]
+    baseline = not has_baseline(table)
+    last_key = None if baseline else high_water_mark(table)
+    filters = {}
+    seen = set()
+    if last_key is not None:
+        after = max(last_key - EXTRACT_OVERLAP_KEYS, 0)
+        filters = {"after": after}
+        seen = landed_keys(table, key_column, after)
+
+    def land(rows):
+        new_rows = (row for row in rows if int(row[key_column]) not in seen)
+        return land_rows(table, new_rows, key_column, baseline=baseline)
+
+    entries, _ = extract_table(table, filters, session, consume=land)
+    landed = sum(entry["rows"] for entry in entries)
+    if entries:
+        last_key = max([entry["max_key"] for entry in entries] + [last_key or 0])
+    logging.info(f"{table}: {landed} new rows, high-water mark {last_key}")
+    return landed
+
+
+def extract_all(tables=None, concurrency=EXTRACT_CONCURRENCY):
+    """Extract several tables concurrently over one shared keep-alive session.
+
+    Each table is a single streamed /export request, so the run takes
+    about as long as the slowest table. Returns {table: new rows landed}.
+    """
+    tables = list(tables or EXTRACT_TABLES)
+    started = time.monotonic()
+    results = {}
+    with api_session(concurrency) as session, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(extract_incremental, table, session): table for table in tables}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    logging.info(f"Extracted {', '.join(tables)} in {time.monotonic() - started:.2f}s.")
+    return results
+
+
 def transform_data_sql():
     """Transform data-SQL-Based Logic."""
-    query = """
-        SELECT 
-            s.customer_id,
-            COALESCE(SUM(p.amount), 0) AS sum_payment
-        FROM 
-            subscriptions s
-        LEFT JOIN 
-            payments p ON s.subscription_id = p.subscription_id
-        GROUP BY 
-            s.customer_id;
+    query = PAYMENT_TOTALS_SQL
+    try:
+        with stage("transform") as result:
+            conn = get_db_connection()
+            cur = conn.cursor()
+            cur.execute(query)
+            results = cur.fetchall()
+            cur.close()
+            conn.close()
+
+            # Transform SQL results into a list of dictionaries
+            transformed_data = [{"customer_id": row[0], "sum_payment": float(row[1])} for row in results]
+            result["rows"] = len(transformed_data)
+        logging.info(f"Transformed data for {len(transformed_data)} customers.")
+
+        return transformed_data
+    except Exception as e:
+        logging.error(f"Error during transformation: {e}")
+        raise
+
+
+def iter_transformed_batches(batch_size=TRANSFORM_BATCH_SIZE):
+    """Yield the SQL transform's results in lists of at most batch_size records.
+
+    Rows are read through a named server-side cursor, so only one batch is
+    held in memory at a time however many customers there are.
     """
+    query = PAYMENT_TOTALS_SQL
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor(name="transform_payment_amount")
+        cur.itersize = batch_size
+        cur.execute(query)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [{"customer_id": row[0], "sum_payment": float(row[1])} for row in rows]
+        cur.close()
+    except Exception as e:
+        logging.error(f"Error during chunked transformation: {e}")
+        raise
+    finally:
+        conn.close()
+
+
+def run_chunked(batches, load_api=False):
+    """Load transformed batches one at a time into the database and optionally the API."""
+    total = 0
+    batches = iter(batches)
+    while True:
+        # Producing a batch is the transform step, whether it reads Postgres or the landing zone
+        with stage("transform") as result:
+            batch = next(batches, None)
+            result["rows"] = len(batch or [])
+        if batch is None:
+            break
+        load_data_to_db(batch)
+        if load_api:
+            load_data_to_api(batch, f"{API_BASE_URL}/payment_amount")
+        total += len(batch)
+    # Absolute sums were written outside the watermark, so rebuild next time
+    invalidate_watermark()
+    logging.info(f"Chunked transform+load finished: {total} customers.")
+    return total
+
+
+def refresh_usage_summary():
+    """Refresh the usage_summary materialized view without blocking readers."""
+    try:
+        started = time.monotonic()
+        with stage("refresh_usage_summary"):
+            conn = get_db_connection()
+            cur = conn.cursor()
+            cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY usage_summary;")
+            # Cached reports over usage_summary are keyed on its version; materialized views have no triggers
+            cur.execute("SELECT bump_table_version('usage_summary')")
+            conn.commit()
+            cur.close()
+            conn.close()
+        logging.info(f"usage_summary refreshed in {time.monotonic() - started:.2f}s.")
+        invalidate_api_cache(["usage_summary"])
+    except Exception as e:
+        logging.error(f"Failed to refresh usage_summary: {e}")
+        raise
+
+
+def ensure_etl_state():
+    """Create the tables holding the incremental payment_amount watermark and applied-payment ledger."""
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute(query)
-        results = cur.fetchall()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS etl_state (
+                name VARCHAR(100) PRIMARY KEY,
+                last_payment_id INTEGER NOT NULL DEFAULT 0,
+                last_payment_date TIMESTAMP,
+                last_subscription_id INTEGER NOT NULL DEFAULT 0,
+                rebuilt_at TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cur.execute("INSERT INTO etl_state (name) VALUES ('payment_amount') ON CONFLICT (name) DO NOTHING;")
+        # Payments near the watermark already added to payment_amount, so a re-scan never adds one twice
+        cur.execute("SELECT to_regclass('etl_applied_payments') IS NULL")
+        if cur.fetchone()[0]:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS etl_applied_payments (
+                    payment_id INTEGER PRIMARY KEY
+                );
+            """)
+            # Totals from before the ledger existed have no record of what was applied; rebuild them once
+            cur.execute("UPDATE etl_state SET rebuilt_at = NULL WHERE name = 'payment_amount';")
+        conn.commit()
         cur.close()
         conn.close()
+    except Exception as e:
+        logging.error(f"Failed to create etl_state table: {e}")
+        raise
 
-        # Transform SQL results into a list of dictionaries
-        transformed_data = [{"customer_id": row[0], "sum_payment": float(row[1])} for row in results]
-        logging.info("Transformed Data:")
-        for record in transformed_data:
-            logging.info(record)
 
-        return transformed_data
+def _lock_watermark(cur):
+    """Lock the payment_amount watermark row and return it with the current high-water marks."""
+    cur.execute("""
+        SELECT last_payment_id, last_subscription_id, rebuilt_at
+        FROM etl_state WHERE name = 'payment_amount' FOR UPDATE;
+    """)
+    last_payment_id, last_subscription_id, rebuilt_at = cur.fetchone()
+    cur.execute("""
+        SELECT
+            (SELECT COALESCE(MAX(payment_id), 0) FROM payments),
+            (SELECT MAX(payment_date) FROM payments),
+            (SELECT COALESCE(MAX(subscription_id), 0) FROM subscriptions);
+    """)
+    return (last_payment_id, last_subscription_id, rebuilt_at), cur.fetchone()
+
+
+def _save_watermark(cur, max_payment_id, max_payment_date, max_subscription_id, rebuilt):
+    cur.execute(f"""
+        UPDATE etl_state
+        SET last_payment_id = %s,
+            last_payment_date = %s,
+            last_subscription_id = %s,
+            {"rebuilt_at = CURRENT_TIMESTAMP," if rebuilt else ""}
+            updated_at = CURRENT_TIMESTAMP
+        WHERE name = 'payment_amount';
+    """, (max_payment_id, max_payment_date, max_subscription_id))
+
+
+def _reset_applied_payments(cur, max_payment_id):
+    """After a full rebuild, record the payments it counted inside the next run's re-scan window."""
+    cur.execute("DELETE FROM etl_applied_payments;")
+    cur.execute("""
+        INSERT INTO etl_applied_payments (payment_id)
+        SELECT payment_id FROM payments WHERE payment_id > %s AND payment_id <= %s;
+    """, (max_payment_id - INCREMENTAL_OVERLAP_IDS, max_payment_id))
+
+
+def _repeatable_read_connection():
+    # All statements of a run must see the same snapshot as the watermark read
+    conn = get_db_connection()
+    conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ)
+    return conn
+
+
+def transform_and_load_sql():
+    """Aggregate payments per customer and upsert payment_amount in one server-side statement.
+
+    Nothing crosses the wire but the statement itself; rows whose sum did
+    not change are left untouched. This is the full rebuild: it also
+    resets the watermark used by transform_and_load_incremental.
+    """
+    query = f"""
+        INSERT INTO payment_amount (customer_id, sum_payment)
+        {PAYMENT_TOTALS_SQL}
+        ON CONFLICT (customer_id) DO UPDATE
+        SET sum_payment = EXCLUDED.sum_payment
+        WHERE payment_amount.sum_payment IS DISTINCT FROM EXCLUDED.sum_payment;
+    """
+    ensure_etl_state()
+    try:
+        started = time.monotonic()
+        with stage("transform_load") as result:
+            conn = _repeatable_read_connection()
+            cur = conn.cursor()
+            _, (max_payment_id, max_payment_date, max_subscription_id) = _lock_watermark(cur)
+            cur.execute(query)
+            upserted = result["rows"] = cur.rowcount
+            _reset_applied_payments(cur, max_payment_id)
+            _save_watermark(cur, max_payment_id, max_payment_date, max_subscription_id, rebuilt=True)
+            conn.commit()
+            cur.close()
+            conn.close()
+        logging.info(f"Pushdown transform+load upserted {upserted} rows in {time.monotonic() - started:.2f}s "
+                     f"(watermark payment_id={max_payment_id}).")
+        invalidate_api_cache(["payment_amount"])
+        return upserted
     except Exception as e:
-        logging.error(f"Error during transformation: {e}")
+        logging.error(f"Error during pushdown transform+load: {e}")
         raise
 
 
-def load_data_to_db(transformed_data):
-    """Load the transformed data into the database."""
-    if not transformed_data:
-        logging.error("Transformed data is empty. Run Transform_data_sql first.")
-        return
+def transform_and_load_incremental():
+    """Apply only payments added since the last run to payment_amount.sum_payment.
 
+    New payments are summed per customer and added to the stored totals,
+    and customers with new subscriptions but no payments get a zero row,
+    so the work scales with new data rather than total history. Falls
+    back to a full rebuild when no rebuild has been recorded yet.
+
+    Ids are handed out before commit, so each run re-scans the last
+    INCREMENTAL_OVERLAP_IDS ids below the watermark. Every payment id is
+    inserted into etl_applied_payments before its amount is added, and only
+    the ids that insert accepted are summed, so a payment that committed
+    late is applied exactly once. Ledger entries below the re-scan window
+    are pruned.
+    """
+    ensure_etl_state()
     try:
-        conn = get_db_connection()
+        started = time.monotonic()
+        conn = _repeatable_read_connection()
         cur = conn.cursor()
-        insert_query = """
+        (last_payment_id, last_subscription_id, rebuilt_at), high_water = _lock_watermark(cur)
+        max_payment_id, max_payment_date, max_subscription_id = high_water
+        if rebuilt_at is None:
+            conn.rollback()
+            conn.close()
+            logging.info("No full rebuild recorded yet; running one instead of an incremental update.")
+            return transform_and_load_sql()
+
+        with stage("transform_load") as result:
+            cur.execute("""
+                INSERT INTO payment_amount (customer_id, sum_payment)
+                SELECT DISTINCT customer_id, 0
+                FROM subscriptions
+                WHERE subscription_id > %s AND subscription_id <= %s
+                ON CONFLICT (customer_id) DO NOTHING;
+            """, (last_subscription_id - INCREMENTAL_OVERLAP_IDS, max_subscription_id))
+            new_customers = cur.rowcount
+            cur.execute("""
+                WITH applied AS (
+                    INSERT INTO etl_applied_payments (payment_id)
+                    SELECT payment_id FROM payments
+                    WHERE payment_id > %s AND payment_id <= %s
+                    ON CONFLICT (payment_id) DO NOTHING
+                    RETURNING payment_id
+                )
+                INSERT INTO payment_amount (customer_id, sum_payment)
+                SELECT
+                    s.customer_id,
+                    SUM(p.amount) AS sum_payment
+                FROM
+                    applied a
+                JOIN
+                    payments p ON p.payment_id = a.payment_id
+                JOIN
+                    subscriptions s ON s.subscription_id = p.subscription_id
+                GROUP BY
+                    s.customer_id
+                ON CONFLICT (customer_id) DO UPDATE
+                SET sum_payment = payment_amount.sum_payment + EXCLUDED.sum_payment;
+            """, (last_payment_id - INCREMENTAL_OVERLAP_IDS, max_payment_id))
+            updated = cur.rowcount
+            # Ids below the next run's re-scan window are never looked at again
+            cur.execute("DELETE FROM etl_applied_payments WHERE payment_id <= %s;",
+                        (max_payment_id - INCREMENTAL_OVERLAP_IDS,))
+            result["rows"] = new_customers + updated
+            _save_watermark(cur, max_payment_id, max_payment_date, max_subscription_id, rebuilt=False)
+            conn.commit()
+            cur.close()
+            conn.close()
+        logging.info(f"Incremental load applied payments up to {max_payment_id} (re-scanning "
+                     f"{INCREMENTAL_OVERLAP_IDS} ids below {last_payment_id}) to {updated} customers and added "
+                     f"{new_customers} new customers in {time.monotonic() - started:.2f}s.")
+        invalidate_api_cache(["payment_amount"])
+        return updated
+    except Exception as e:
+        logging.error(f"Error during incremental transform+load: {e}")
+        raise
+
+
+def invalidate_watermark():
+    """Force the next incremental run to rebuild, after payment_amount was overwritten elsewhere."""
+    ensure_etl_state()
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("UPDATE etl_state SET rebuilt_at = NULL, updated_at = CURRENT_TIMESTAMP WHERE name = 'payment_amount';")
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def _upsert_batches_values(cur, rows, batch_size):
+    """Upsert rows with one multi-row INSERT ... ON CONFLICT per batch."""
+    insert_query = """
+    INSERT INTO payment_amount (customer_id, sum_payment)
+    VALUES %s
+    ON CONFLICT (customer_id) DO UPDATE
+    SET sum_payment = EXCLUDED.sum_payment;
+    """
+    for start in range(0, len(rows), batch_size):
+        batch_started = time.monotonic()
+        batch = rows[start:start + batch_size]
+        execute_values(cur, insert_query, batch, page_size=batch_size)
+        logging.info(f"Upserted batch of {len(batch)} rows in {time.monotonic() - batch_started:.3f}s")
+
+
+def _upsert_batches_copy(cur, rows, batch_size):
+    """COPY rows into a temp staging table and merge them with one INSERT ... SELECT."""
+    cur.execute("""
+        CREATE TEMP TABLE payment_amount_stage (
+            customer_id INT NOT NULL,
+            sum_payment NUMERIC(10, 2) NOT NULL
+        ) ON COMMIT DROP;
+    """)
+    for start in range(0, len(rows), batch_size):
+        batch_started = time.monotonic()
+        batch = rows[start:start + batch_size]
+        buffer = io.StringIO("".join(f"{customer_id}\t{sum_payment}\n" for customer_id, sum_payment in batch))
+        cur.copy_expert("COPY payment_amount_stage (customer_id, sum_payment) FROM STDIN", buffer)
+        logging.info(f"Staged batch of {len(batch)} rows in {time.monotonic() - batch_started:.3f}s")
+    merge_started = time.monotonic()
+    cur.execute("""
         INSERT INTO payment_amount (customer_id, sum_payment)
-        VALUES (%s, %s)
+        SELECT customer_id, sum_payment FROM payment_amount_stage
         ON CONFLICT (customer_id) DO UPDATE
         SET sum_payment = EXCLUDED.sum_payment;
-        """
-        for record in transformed_data:
-            cur.execute(insert_query, (record["customer_id"], record["sum_payment"]))
-        conn.commit()
-        cur.close()
-        conn.close()
-        logging.info("Data loaded successfully into the database.")
+    """)
+    logging.info(f"Merged staged rows in {time.monotonic() - merge_started:.3f}s")
+
+
+def load_data_to_db(transformed_data, batch_size=LOAD_BATCH_SIZE, method=LOAD_METHOD):
+    """Load the transformed data into the database.
+
+    method "values" sends multi-row upserts of batch_size rows; "copy"
+    streams the rows into a temporary staging table and merges them in a
+    single statement. Both run in one transaction.
+    """
+    if not transformed_data:
+        logging.error("Transformed data is empty. Run Transform_data_sql first.")
+        return
+    if method not in ("values", "copy"):
+        raise ValueError(f"Unknown load method: {method}")
+
+    rows = [(record["customer_id"], record["sum_payment"]) for record in transformed_data]
+    try:
+        started = time.monotonic()
+        with stage("load_db", method=method) as result:
+            conn = get_db_connection()
+            cur = conn.cursor()
+            if method == "copy":
+                _upsert_batches_copy(cur, rows, batch_size)
+            else:
+                _upsert_batches_values(cur, rows, batch_size)
+            conn.commit()
+            cur.close()
+            conn.close()
+            result["rows"] = len(rows)
+        elapsed = time.monotonic() - started
+        logging.info(f"Data loaded successfully into the database: {len(rows)} rows in {elapsed:.2f}s "
+                     f"({len(rows) / max(elapsed, 1e-9):.0f} rows/s, method={method}, batch_size={batch_size}).")
+        invalidate_api_cache(["payment_amount"])
     except Exception as e:
         logging.error(f"Error loading data to the database: {e}")
         raise
 
 
-def load_data_to_api(transformed_data, api_endpoint_app):
-    """Load transformed data to the /payment_amount API endpoint."""
+def _post_chunk(session, api_endpoint_app, chunk, index):
+    """POST one gzip-compressed chunk, retrying transient failures with exponential backoff."""
+    body = gzip.compress(json.dumps({"data": chunk}).encode())
+    headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+
+    def post():
+        response = session.post(api_endpoint_app, data=body, headers=headers, timeout=API_TIMEOUT)
+        response.raise_for_status()
+
+    with_retries(post, f"Chunk {index}", API_LOAD_RETRIES)
+    logging.info(f"Chunk {index}: {len(chunk)} rows loaded ({len(body)} bytes gzipped).")
+    return len(chunk)
+
+
+def load_data_to_api(transformed_data, api_endpoint_app, chunk_size=API_LOAD_CHUNK_SIZE,
+                     concurrency=API_LOAD_CONCURRENCY):
+    """Load transformed data to the /payment_amount API endpoint.
+
+    Records are sent as gzip-compressed {"data": [...]} chunks of
+    chunk_size, up to 'concurrency' at a time over one keep-alive session.
+    Each chunk is retried on its own; the load fails if any chunk still
+    fails after API_LOAD_RETRIES attempts.
+    """
     if not transformed_data:
         logging.error("Transformed data is empty. Cannot load to API.")
         return
 
-    # Wrap the data into a JSON object
-    payload = {"data": transformed_data}
+    chunks = [transformed_data[start:start + chunk_size] for start in range(0, len(transformed_data), chunk_size)]
+    logging.info(f"Loading {len(transformed_data)} rows into API endpoint {api_endpoint_app} "
+                 f"in {len(chunks)} chunks ({concurrency} concurrent)...")
+    started = time.monotonic()
+    failed = []
+    with stage("load_api", chunks=len(chunks)) as result:
+        with api_session(concurrency) as session, ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {
+                executor.submit(_post_chunk, session, api_endpoint_app, chunk, index): index
+                for index, chunk in enumerate(chunks)
+            }
+            for future in as_completed(futures):
+                try:
+                    result["rows"] += future.result()
+                except Exception as e:
+                    logging.error(f"Chunk {futures[future]} failed permanently: {e}")
+                    failed.append(futures[future])
 
-    try:
-        logging.info(f"Loading data into API endpoint {api_endpoint_app}...")
-        logging.info(f"Payload: {payload}")  # Log the formatted payload
-        response = requests.post(api_endpoint_app, json=payload)
-        logging.info(f"API Response: {response.status_code}, {response.text}")
-        response.raise_for_status()
-        logging.info("Data successfully loaded into the API.")
-    except Exception as e:
-        logging.error(f"Failed to load data into API endpoint {api_endpoint_app}: {e}")
-        raise
+        if failed:
+            raise RuntimeError(f"Failed to load {len(failed)} of {len(chunks)} chunks into {api_endpoint_app}: "
+                               f"{sorted(failed)}")
+    logging.info(f"Data successfully loaded into the API in {time.monotonic() - started:.2f}s.")
 
 
 if __name__== "__main__":
      # Determine if  running the full ETL or just the extraction step
     mode = sys.argv[1] if len(sys.argv) > 1 else "full"
-    if mode == "extract":
-        ##Only Extract the Data From the API##
-            #for customer
-        api_endpoint_customer = "http://localhost:5001/customers"
-        extracted_customer_data = extract_data(api_endpoint_customer,30)
-            #for subscriptions
-        api_endpoint_subscriptions= "http://localhost:5001/subscriptions"
-        extracted_subscription_data = extract_data(api_endpoint_subscriptions,30)
-            #for payments
-        api_endpoint_payments = "http://localhost:5001/payments"
-        extracted_payments_data = extract_data(api_endpoint_payments,30)
-            #for usage
-        api_endpoint_usage = "http://localhost:5001/usage"
-        extracted_usage_data = extract_data(api_endpoint_usage,30)
-    else:
-        ### RUN FULL ETL PIPELINE ##
-        # Step 1: Change database schema
-        change_db_schema()
-
-        # Step 2: Transform data using SQL
-        transformed_data = transform_data_sql()
-
-        # Step 3: Load data into the database
-        load_data_to_db(transformed_data)
-        # Step 4: Load data into the API
-        api_endpoint_app = "http://localhost:5001/payment_amount"
-        load_data_to_api(transformed_data, api_endpoint_app)
\ No newline at end of file
+    run_started = time.monotonic()
+    succeeded = False
+    try:
+        if mode == "extract":
+            ##Only Extract the Data From the API##
+            # All tables are fetched concurrently
+            # Rows are streamed into the landing zone; only the counts come back
+            extract_all(EXTRACT_TABLES)
+        elif mode == "refresh-usage-summary":
+            ### REFRESH THE PER-CUSTOMER USAGE SUMMARY ##
+            refresh_usage_summary()
+        elif mode == "pushdown":
+            ### RUN TRANSFORM+LOAD INSIDE POSTGRES ##
+            # The API load writes the same payment_amount table, so it is not needed here
+            change_db_schema()
+            transform_and_load_sql()
+        elif mode == "landing":
+            ### TRANSFORM FROM THE LOCAL LANDING ZONE ##
+            from vectorized_transform import transform_landed_payments
+            change_db_schema()
+            with stage("transform") as result:
+                transformed_data = transform_landed_payments()
+                result["rows"] = len(transformed_data)
+            load_data_to_db(transformed_data)
+            # Absolute sums were written outside the watermark, so rebuild next time
+            invalidate_watermark()
+        elif mode == "chunked":
+            ### STREAM THE SQL TRANSFORM IN BOUNDED BATCHES ##
+            change_db_schema()
+            run_chunked(iter_transformed_batches(), load_api="--api" in sys.argv)
+        elif mode == "landing-chunked":
+            ### OUT-OF-CORE TRANSFORM FROM THE LANDING ZONE ##
+            from chunked_aggregate import chunked_payment_totals
+            change_db_schema()
+            run_chunked(chunked_payment_totals())
+        elif mode == "incremental":
+            ### APPLY ONLY NEW PAYMENTS ##
+            change_db_schema()
+            transform_and_load_incremental()
+        else:
+            ### RUN FULL ETL PIPELINE ##
+            # Step 1: Change database schema
+            change_db_schema()
+
+            # Step 2: Transform data using SQL
+            transformed_data = transform_data_sql()
+
+            # Step 3: Load data into the database
+            load_data_to_db(transformed_data)
+            # Absolute sums were written outside the watermark, so rebuild next time
+            invalidate_watermark()
+            # Step 4: Load data into the API
+            api_endpoint_app = f"{API_BASE_URL}/payment_amount"
+            load_data_to_api(transformed_data, api_endpoint_app)
+        succeeded = True
+    finally:
+        # Per-stage timings and row counts for this run, whether it succeeded or not
+        write_run_metrics(mode, succeeded, time.monotonic() - run_started)
\ No newline at end of file
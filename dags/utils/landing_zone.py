@@ -0,0 +1,330 @@
+import gzip
+import io
+import json
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime
+from itertools import islice
+
+import numpy as np
+
+# Parquet is used when pyarrow is installed (it is in requirements.txt), gzip NDJSON otherwise
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.json as pa_json
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pc = None
+    pa_json = None
+    pq = None
+
+# Root of the local landing zone: <root>/<table>/dt=YYYY-MM-DD/part-*.{parquet,ndjson.gz}
+LANDING_DIR = os.path.join(os.getenv("ETL_DATA_DIR", "/opt/airflow/data"), "landing")
+LANDING_FORMAT = os.getenv("LANDING_FORMAT", "parquet" if pa is not None else "ndjson")
+MANIFEST_PATH = os.path.join(LANDING_DIR, "_manifest.json")
+# Rows per landed file; a full extract is split into parts so no file has to be read whole
+LANDING_PART_ROWS = int(os.getenv("LANDING_PART_ROWS", 500000))
+# Rows decoded at a time when a landed file is read, which bounds memory whatever the table size
+LANDING_READ_BATCH_ROWS = int(os.getenv("LANDING_READ_BATCH_ROWS", 65536))
+
+# Column types of the landed tables. The API sends decimals as strings, so they are cast once
+# when landed (and again on read for older files) and the transforms get numeric arrays
+LANDING_TYPES = {
+    "customers": {"customer_id": "int64"},
+    "subscriptions": {"subscription_id": "int64", "customer_id": "int64"},
+    "payments": {"payment_id": "int64", "subscription_id": "int64", "amount": "float64"},
+    "usage": {"usage_id": "int64", "subscription_id": "int64", "data_usage": "float64",
+              "call_minutes": "float64", "sms_count": "int64"},
+}
+
+_manifest_lock = threading.Lock()
+
+
+def _atomic_write(path, write):
+    """Write a file through a temporary sibling and rename it into place."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_manifest():
+    """Return the manifest.
+
+    {"files": [{table, path, rows, min_key, max_key, ...}, ...],
+     "baselines": {table: created_at of its last full extract}}
+    """
+    if not os.path.exists(MANIFEST_PATH):
+        return {"files": [], "baselines": {}}
+    with open(MANIFEST_PATH) as f:
+        manifest = json.load(f)
+    manifest.setdefault("baselines", {})
+    return manifest
+
+
+def _write_manifest(manifest):
+    def write(tmp_path):
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    _atomic_write(MANIFEST_PATH, write)
+
+
+def _typed(table, data):
+    """Cast the columns of an Arrow table that have a LANDING_TYPES type."""
+    types = LANDING_TYPES.get(table, {})
+    for index, name in enumerate(data.column_names):
+        target = types.get(name)
+        if target is not None and data.schema.field(name).type != pa.type_for_alias(target):
+            data = data.set_column(index, name, pc.cast(data.column(name), target))
+    return data
+
+
+class _PartWriter:
+    """Stream batches of rows into one part file, tracking its row count and key range.
+
+    Rows go to a temporary sibling that close() renames into place, so a
+    part is never visible half-written.
+    """
+
+    def __init__(self, table, key_column, landing_format, now):
+        self.table = table
+        self.key_column = key_column
+        self.landing_format = landing_format
+        self.now = now
+        extension = "parquet" if landing_format == "parquet" else "ndjson.gz"
+        file_name = f"part-{now.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}.{extension}"
+        self.path = os.path.join(LANDING_DIR, table, f"dt={now.strftime('%Y-%m-%d')}", file_name)
+        self.tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.rows = 0
+        self.min_key = None
+        self.max_key = None
+        self._parquet = None
+        self._schema = None
+        self._ndjson = None
+        if landing_format == "parquet":
+            if pa is None:
+                raise RuntimeError("LANDING_FORMAT=parquet requires pyarrow")
+        else:
+            self._ndjson = gzip.open(self.tmp_path, "wt")
+
+    def write(self, rows):
+        if not rows:
+            return
+        if self.landing_format == "parquet":
+            data = _typed(self.table, pa.Table.from_pylist(rows))
+            if self._parquet is None:
+                # Columns that are all null in the first batch are strings, like the rest of the API's text
+                schema = pa.schema([pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field
+                                    for field in data.schema])
+                self._schema = schema
+                self._parquet = pq.ParquetWriter(self.tmp_path, schema, compression="zstd")
+            # One row group per batch lets readers decode a file a batch at a time
+            self._parquet.write_table(data.cast(self._schema))
+        else:
+            for row in rows:
+                self._ndjson.write(json.dumps(row) + "\n")
+        if self.min_key is None:
+            self.min_key = rows[0][self.key_column]
+        self.max_key = rows[-1][self.key_column]
+        self.rows += len(rows)
+
+    def _close_file(self):
+        if self._parquet is not None:
+            self._parquet.close()
+        if self._ndjson is not None:
+            self._ndjson.close()
+
+    def close(self):
+        """Finish the file, move it into place and return its manifest entry."""
+        self._close_file()
+        os.replace(self.tmp_path, self.path)
+        return {
+            "table": self.table,
+            "path": os.path.relpath(self.path, LANDING_DIR),
+            "format": self.landing_format,
+            "rows": self.rows,
+            "min_key": self.min_key,
+            "max_key": self.max_key,
+            "bytes": os.path.getsize(self.path),
+            "created_at": self.now.isoformat(),
+        }
+
+    def abort(self):
+        self._close_file()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def land_rows(table, rows, key_column, landing_format=None, baseline=False, part_rows=None):
+    """Stream one extract of a table into compressed, date-partitioned files of at most part_rows rows.
+
+    rows may be any iterable in key order, such as a streamed API
+    response; it is consumed LANDING_READ_BATCH_ROWS rows at a time, so
+    memory does not grow with the extract. Data files are renamed into
+    place before the manifest references them, so readers going through
+    the manifest never see a partial file; all parts of an extract are
+    added to the manifest together, and none if the extract fails.
+    baseline marks a full, unfiltered extract: it replaces the table's
+    earlier entries and is recorded even when the table is empty.
+    Returns the manifest entries.
+    """
+    now = datetime.now()
+    landing_format = landing_format or LANDING_FORMAT
+    part_rows = part_rows or LANDING_PART_ROWS
+    rows = iter(rows)
+    entries = []
+    writer = None
+    try:
+        while True:
+            room = part_rows - (writer.rows if writer else 0)
+            batch = list(islice(rows, min(LANDING_READ_BATCH_ROWS, room)))
+            if not batch:
+                break
+            if writer is None:
+                writer = _PartWriter(table, key_column, landing_format, now)
+            writer.write(batch)
+            if writer.rows >= part_rows:
+                entries.append(writer.close())
+                writer = None
+        if writer is not None:
+            entries.append(writer.close())
+            writer = None
+    except BaseException:
+        # Parts not yet in the manifest would never be read or cleaned up
+        if writer is not None:
+            writer.abort()
+        _remove_files(entries)
+        raise
+    if entries or baseline:
+        _record_entries(table, entries, now if baseline else None)
+    for entry in entries:
+        logging.info(f"Landed {entry['rows']} {table} rows in {entry['path']} ({entry['bytes']} bytes).")
+    return entries
+
+
+def _remove_files(entries):
+    for entry in entries:
+        path = os.path.join(LANDING_DIR, entry["path"])
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _record_entries(table, entries, baseline_at):
+    """Add entries to the manifest; with baseline_at, first drop the table's older entries and files."""
+    with _manifest_lock:
+        manifest = load_manifest()
+        superseded = []
+        if baseline_at is not None:
+            superseded = [old for old in manifest["files"] if old["table"] == table]
+            manifest["files"] = [old for old in manifest["files"] if old["table"] != table]
+            manifest["baselines"][table] = baseline_at.isoformat()
+        manifest["files"].extend(entries)
+        _write_manifest(manifest)
+    _remove_files(superseded)
+
+
+def has_baseline(table):
+    """Whether a full extract of the table has been landed, so its landed files hold every row."""
+    return table in load_manifest()["baselines"]
+
+
+def high_water_mark(table):
+    """Largest key landed for a table, or None; the only record of how far extraction got."""
+    keys = [entry["max_key"] for entry in load_manifest()["files"] if entry["table"] == table]
+    return max(keys) if keys else None
+
+
+def require_baseline(tables):
+    """Raise unless every table has a full landed baseline; partial data would give wrong totals."""
+    missing = [table for table in tables if not has_baseline(table)]
+    if missing:
+        raise RuntimeError(f"No full extract landed yet for {', '.join(missing)}; "
+                           f"run 'etl_pipeline.py extract' first.")
+
+
+def table_files(table):
+    """Manifest entries for a table in key order; together they form its latest snapshot."""
+    entries = [entry for entry in load_manifest()["files"] if entry["table"] == table]
+    return sorted(entries, key=lambda entry: entry["min_key"])
+
+
+def _column_arrays(table, data, columns):
+    """Turn an Arrow table into {column: values}: NumPy arrays (nulls as 0) for numeric columns, lists otherwise."""
+    data = _typed(table, data)
+    batch = {}
+    for column in columns:
+        target = LANDING_TYPES.get(table, {}).get(column)
+        if column not in data.column_names:
+            batch[column] = np.zeros(data.num_rows, dtype=target) if target else [None] * data.num_rows
+            continue
+        values = data.column(column)
+        if pa.types.is_integer(values.type) or pa.types.is_floating(values.type):
+            batch[column] = values.fill_null(0).to_numpy()
+        else:
+            batch[column] = values.to_pylist()
+    return batch
+
+
+def _iter_entry_batches(table, entry, columns, batch_rows=None):
+    """Yield the given columns of one landed file as {column: values}, batch_rows rows at a time."""
+    batch_rows = batch_rows or LANDING_READ_BATCH_ROWS
+    path = os.path.join(LANDING_DIR, entry["path"])
+    if entry["format"] == "parquet":
+        if pa is None:
+            raise RuntimeError(f"Reading {path} requires pyarrow")
+        parquet_file = pq.ParquetFile(path)
+        present = [column for column in columns if column in parquet_file.schema_arrow.names]
+        for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=present):
+            yield _column_arrays(table, pa.Table.from_batches([batch]), columns)
+        return
+    with gzip.open(path, "rb") as f:
+        while True:
+            lines = [line for line in islice(f, batch_rows) if line.strip()]
+            if not lines:
+                break
+            if pa is not None:
+                yield _column_arrays(table, pa_json.read_json(io.BytesIO(b"".join(lines))), columns)
+            else:
+                rows = [json.loads(line) for line in lines]
+                yield {column: [row.get(column) for row in rows] for column in columns}
+
+
+def iter_column_batches(table, columns):
+    """Yield {column: values} for the landed files of a table, LANDING_READ_BATCH_ROWS rows at a time.
+
+    Memory stays bounded by the batch size whatever the size of a file or
+    the table. Parquet is read row group by row group and only decodes the
+    requested columns; NDJSON is parsed by Arrow in blocks of lines,
+    without a Python object per row.
+    """
+    for entry in table_files(table):
+        yield from _iter_entry_batches(table, entry, columns)
+
+
+def landed_keys(table, key_column, after):
+    """Keys above after that are already landed for a table; only files reaching past after are read."""
+    keys = set()
+    for entry in table_files(table):
+        if entry["max_key"] > after:
+            for batch in _iter_entry_batches(table, entry, [key_column]):
+                keys.update(int(key) for key in batch[key_column] if key > after)
+    return keys
+
+
+def read_columns(table, columns):
+    """Read the given columns of a table's whole landed snapshot into lists."""
+    result = {column: [] for column in columns}
+    for batch in iter_column_batches(table, columns):
+        for column in columns:
+            result[column].extend(batch[column])
+    return result
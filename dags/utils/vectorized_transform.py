@@ -0,0 +1,122 @@
+import logging
+import time
+
+import numpy as np
+
+from landing_zone import iter_column_batches, require_baseline
+
+# Keys up to DENSE_KEY_FACTOR * count + DENSE_KEY_SLACK are joined through a direct index table
+DENSE_KEY_FACTOR = 4
+DENSE_KEY_SLACK = 1_000_000
+
+
+def to_array(values, dtype):
+    """Convert a column (list or array) to a NumPy array, treating None as 0."""
+    if isinstance(values, np.ndarray) and values.dtype != object:
+        return values.astype(dtype, copy=False)
+    array = np.asarray(values, dtype=object)
+    if array.size:
+        array[array == None] = 0  # noqa: E711 - elementwise comparison
+    return array.astype(dtype)
+
+
+def landed_column(table, column, dtype):
+    """Concatenate one column of a table's landed snapshot into a single array."""
+    parts = [to_array(batch[column], dtype) for batch in iter_column_batches(table, [column])]
+    return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+
+def aggregate_payments_by_customer(subscription_ids, subscription_customer_ids,
+                                   payment_subscription_ids, payment_amounts):
+    """Sum payments per customer with array operations instead of per-row dicts.
+
+    Payments are joined to subscriptions through an index table (or a
+    sorted search for sparse keys), and the per-customer sums are a single
+    bincount over integer cents, so the totals are exact. Missing values
+    are treated as 0. Every customer with a subscription gets a total,
+    0 if it has no payments, matching the SQL transform.
+
+    Returns (customer_ids, sum_payments, orphan_subscription_ids), where
+    orphan_subscription_ids are subscription ids referenced by payments
+    but missing from subscriptions.
+    """
+    subscription_ids = to_array(subscription_ids, np.int64)
+    subscription_customer_ids = to_array(subscription_customer_ids, np.int64)
+    payment_subscription_ids = to_array(payment_subscription_ids, np.int64)
+    payment_cents = np.rint(to_array(payment_amounts, np.float64) * 100).astype(np.int64)
+
+    # payments -> subscriptions
+    payment_customer_ids, matched = join_keys(subscription_ids, subscription_customer_ids, payment_subscription_ids)
+    orphan_subscription_ids = np.unique(payment_subscription_ids[~matched])
+
+    # subscriptions -> customers, then group by customer
+    customer_ids = np.unique(subscription_customer_ids)
+    if _is_dense(customer_ids):
+        sum_cents = np.bincount(payment_customer_ids, weights=payment_cents[matched],
+                                minlength=int(customer_ids[-1]) + 1)[customer_ids]
+    else:
+        customer_index = np.searchsorted(customer_ids, payment_customer_ids)
+        sum_cents = np.bincount(customer_index, weights=payment_cents[matched], minlength=customer_ids.size)
+    return customer_ids, sum_cents / 100.0, orphan_subscription_ids
+
+
+def _is_dense(keys):
+    # Serial keys are small non-negative integers, so direct indexing beats searching
+    return keys.size > 0 and keys.min() >= 0 and keys.max() <= DENSE_KEY_FACTOR * keys.size + DENSE_KEY_SLACK
+
+
+def join_keys(keys, values, lookups):
+    """Map each lookup key to the value of the matching key.
+
+    Returns (values of matched lookups, boolean mask of matched lookups).
+    Dense serial keys use a direct index table; anything else falls back
+    to a sorted search.
+    """
+    if keys.size == 0:
+        return np.empty(0, dtype=values.dtype), np.zeros(lookups.size, dtype=bool)
+    if _is_dense(keys):
+        table = np.full(int(keys.max()) + 1, -1, dtype=np.int64)
+        present = np.zeros(table.size, dtype=bool)
+        table[keys] = values
+        present[keys] = True
+        in_range = (lookups >= 0) & (lookups < table.size)
+        matched = np.zeros(lookups.size, dtype=bool)
+        matched[in_range] = present[lookups[in_range]]
+        return table[lookups[matched]], matched
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    positions = np.minimum(np.searchsorted(sorted_keys, lookups), sorted_keys.size - 1)
+    matched = sorted_keys[positions] == lookups
+    return values[order][positions[matched]], matched
+
+
+def to_records(customer_ids, sum_payments):
+    """Build the [{"customer_id", "sum_payment"}] records expected by the load steps."""
+    return [
+        {"customer_id": customer_id, "sum_payment": sum_payment}
+        for customer_id, sum_payment in zip(customer_ids.tolist(), np.round(sum_payments, 2).tolist())
+    ]
+
+
+def transform_landed_payments():
+    """Aggregate payments per customer from the landing zone instead of the database.
+
+    The totals are absolute, so this refuses to run until full extracts of
+    subscriptions and payments have been landed.
+    """
+    require_baseline(["subscriptions", "payments"])
+    started = time.monotonic()
+    subscription_ids = landed_column("subscriptions", "subscription_id", np.int64)
+    subscription_customer_ids = landed_column("subscriptions", "customer_id", np.int64)
+    payment_subscription_ids = landed_column("payments", "subscription_id", np.int64)
+    payment_amounts = landed_column("payments", "amount", np.float64)
+    read_seconds = time.monotonic() - started
+
+    customer_ids, sum_payments, orphans = aggregate_payments_by_customer(
+        subscription_ids, subscription_customer_ids, payment_subscription_ids, payment_amounts)
+    if orphans.size:
+        logging.warning(f"{orphans.size} subscription IDs referenced by payments are missing: "
+                        f"{orphans[:20].tolist()}{' ...' if orphans.size > 20 else ''}")
+    logging.info(f"Aggregated {payment_subscription_ids.size} payments into {customer_ids.size} customers "
+                 f"(read {read_seconds:.2f}s, total {time.monotonic() - started:.2f}s).")
+    return to_records(customer_ids, sum_payments)
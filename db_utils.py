@@ -1,10 +1,21 @@
 import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2 import extensions as pg_extensions
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import date
+import argparse
+import io
 import random
 import string
 import logging
+import threading
+import time
 from dotenv import load_dotenv
 import os
 
+import metrics
+
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logging.info("Starting data generation script...")
@@ -17,6 +28,85 @@ db_params = {
     'password': os.getenv('POSTGRES_PASSWORD', 'postgres')
 }
 
+# Synthetic data volume per table, overridable per run
+DEFAULT_ROW_COUNTS = {
+    'customers': int(os.getenv('SEED_CUSTOMERS_ROWS', '500')),
+    'subscriptions': int(os.getenv('SEED_SUBSCRIPTIONS_ROWS', '500')),
+    'payments': int(os.getenv('SEED_PAYMENTS_ROWS', '500')),
+    'usage': int(os.getenv('SEED_USAGE_ROWS', '500')),
+}
+# Rows generated and streamed per COPY statement
+COPY_CHUNK_ROWS = int(os.getenv('SEED_CHUNK_ROWS', '100000'))
+SUBSCRIPTION_TYPES = ["Basic", "Premium", "Enterprise"]
+
+# Columns written by the COPY loader; the first one is the serial key
+COPY_COLUMNS = {
+    'customers': ('customer_id', 'name', 'email', 'phone'),
+    'subscriptions': ('subscription_id', 'customer_id', 'subscription_type', 'start_date', 'end_date'),
+    'payments': ('payment_id', 'subscription_id', 'amount'),
+    'usage': ('usage_id', 'subscription_id', 'data_usage', 'call_minutes', 'sms_count'),
+}
+
+# Per-customer usage counts, sums and averages maintained as a materialized view.
+# Counts are per column so the averages ignore NULLs exactly like AVG().
+USAGE_SUMMARY_SQL = """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS usage_summary AS
+    SELECT
+        s.customer_id,
+        COUNT(*) AS usage_count,
+        COUNT(u.call_minutes) AS call_minutes_count,
+        SUM(u.call_minutes) AS call_minutes_sum,
+        COUNT(u.data_usage) AS data_usage_count,
+        SUM(u.data_usage) AS data_usage_sum,
+        COUNT(u.sms_count) AS sms_count_count,
+        SUM(u.sms_count) AS sms_count_sum,
+        AVG(u.call_minutes::NUMERIC) AS avg_call_minutes,
+        AVG(u.data_usage::NUMERIC) AS avg_data_usage,
+        AVG(u.sms_count) AS avg_sms_count
+    FROM
+        subscriptions s
+    JOIN
+        usage u ON s.subscription_id = u.subscription_id
+    GROUP BY
+        s.customer_id;
+"""
+
+# Arbitrary key for the advisory lock held while migrations run
+MIGRATION_LOCK_KEY = int(os.getenv('DB_MIGRATION_LOCK_KEY', '727001'))
+# Optional declarative range partitioning of the fact tables by month
+PARTITIONED_TABLES = os.getenv('DB_PARTITIONING', 'false').lower() == 'true'
+PARTITIONED_COLUMNS = {'payments': 'payment_date', 'usage': 'usage_date'}
+PARTITION_START = os.getenv('DB_PARTITION_START', '2024-01-01')
+PARTITION_MONTHS_AHEAD = int(os.getenv('DB_PARTITION_MONTHS_AHEAD', '3'))
+
+# Connection pool configuration
+POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+# Seconds a request waits for a free connection before giving up
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+# Connections idle longer than this are pinged before being handed out
+POOL_PRE_PING_IDLE = float(os.getenv('DB_POOL_PRE_PING_IDLE', '30'))
+
+_pool = None
+_pool_pid = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+_last_used = {}
+_stats_lock = threading.Lock()
+_pool_stats = {
+    'checkouts': 0,
+    'timeouts': 0,
+    'reconnects': 0,
+    'in_use': 0,
+    'wait_seconds_total': 0.0,
+    'wait_seconds_max': 0.0,
+    'checkout_seconds_total': 0.0,
+    'checkout_seconds_max': 0.0,
+    'hold_seconds_total': 0.0,
+    'hold_seconds_max': 0.0,
+}
+
+
 def get_db_connection():
     try:
         conn = psycopg2.connect(**db_params)
@@ -26,120 +116,641 @@ def get_db_connection():
         raise
 
 
-def create_tables():
-    conn = get_db_connection()
-    cur = conn.cursor()
+def _record_stat(name, value):
+    with _stats_lock:
+        _pool_stats[f'{name}_seconds_total'] += value
+        if value > _pool_stats[f'{name}_seconds_max']:
+            _pool_stats[f'{name}_seconds_max'] = value
+
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use.
+
+    The pool is re-created after a fork so every worker process owns its own
+    sockets; connections inherited from the parent are abandoned, not closed,
+    because closing them would terminate the parent's sessions.
+    """
+    global _pool, _pool_pid, _pool_slots, _last_used
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            logging.info(f"Initializing connection pool (min={POOL_MIN_SIZE}, max={POOL_MAX_SIZE}) in pid {pid}...")
+            _pool = pg_pool.ThreadedConnectionPool(POOL_MIN_SIZE, POOL_MAX_SIZE, **db_params)
+            _pool_slots = threading.BoundedSemaphore(POOL_MAX_SIZE)
+            _pool_pid = pid
+            _last_used = {}
+            with _stats_lock:
+                _pool_stats['in_use'] = 0
+    return _pool
 
+
+def close_pool():
+    """Close every connection held by this process's pool."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+            logging.info("Connection pool closed.")
+        _pool = None
+        _pool_pid = None
+
+
+def _is_healthy(conn):
+    if conn.closed:
+        return False
+    last_used = _last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < POOL_PRE_PING_IDLE:
+        return True
     try:
-        logging.info("Dropping existing tables if any...")
-        cur.execute("DROP TABLE IF EXISTS usage, payments, subscriptions, customers, payment_amount CASCADE;")
-        logging.info("Creating 'customers' table...")
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS customers (
-                customer_id SERIAL PRIMARY KEY,
-                name VARCHAR(255),
-                email VARCHAR(255),
-                phone VARCHAR(20),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        logging.info("Creating 'subscriptions' table...")
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS subscriptions (
-                subscription_id SERIAL PRIMARY KEY,
-                customer_id INTEGER REFERENCES customers(customer_id),
-                subscription_type VARCHAR(50),
-                start_date DATE,
-                end_date DATE
-            );
-        """)
-        logging.info("Creating 'payments' table...")
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS payments (
-                payment_id SERIAL PRIMARY KEY,
-                subscription_id INTEGER REFERENCES subscriptions(subscription_id),
-                payment_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                amount DECIMAL(10, 2)
-            );
-        """)
-        logging.info("Creating 'usage' table...")
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS usage (
-                usage_id SERIAL PRIMARY KEY,
-                subscription_id INTEGER REFERENCES subscriptions(subscription_id),
-                data_usage DECIMAL(10, 2),
-                call_minutes DECIMAL(10, 2),
-                sms_count INTEGER
-            );
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _checkout():
+    pool = get_pool()
+    slots = _pool_slots
+    started = time.monotonic()
+    if not slots.acquire(timeout=POOL_TIMEOUT):
+        with _stats_lock:
+            _pool_stats['timeouts'] += 1
+        metrics.POOL_TIMEOUTS.inc()
+        metrics.add('pool_wait', time.monotonic() - started)
+        raise pg_pool.PoolError(f"Timed out after {POOL_TIMEOUT}s waiting for a database connection")
+    waited = time.monotonic() - started
+    _record_stat('wait', waited)
+    metrics.POOL_WAIT.observe(waited)
+    metrics.add('pool_wait', waited)
+    try:
+        conn = pool.getconn()
+        if not _is_healthy(conn):
+            logging.warning("Discarding broken pooled connection and reconnecting...")
+            pool.putconn(conn, close=True)
+            _last_used.pop(id(conn), None)
+            with _stats_lock:
+                _pool_stats['reconnects'] += 1
+            conn = pool.getconn()
+    except Exception:
+        slots.release()
+        raise
+    _record_stat('checkout', time.monotonic() - started)
+    with _stats_lock:
+        _pool_stats['checkouts'] += 1
+        _pool_stats['in_use'] += 1
+    return pool, slots, conn
+
+
+def _release(pool, slots, conn, checked_out_at):
+    try:
+        if not conn.closed and conn.get_transaction_status() != pg_extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error as e:
+        logging.error(f"Error resetting pooled connection: {e}")
+    try:
+        if conn.closed:
+            _last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+        else:
+            _last_used[id(conn)] = time.monotonic()
+            pool.putconn(conn)
+    finally:
+        slots.release()
+        _record_stat('hold', time.monotonic() - checked_out_at)
+        with _stats_lock:
+            _pool_stats['in_use'] -= 1
+
+
+@contextmanager
+def db_connection():
+    """Borrow a connection from the pool for the duration of a with-block.
+
+    Any transaction left open by the caller is rolled back before the
+    connection is returned, so commit explicitly.
+    """
+    pool, slots, conn = _checkout()
+    checked_out_at = time.monotonic()
+    try:
+        yield conn
+    finally:
+        _release(pool, slots, conn, checked_out_at)
+
+
+def pool_stats():
+    """Snapshot of pool wait/checkout/hold timings for sizing the pool."""
+    with _stats_lock:
+        stats = dict(_pool_stats)
+    checkouts = stats['checkouts'] or 1
+    stats['wait_seconds_avg'] = stats['wait_seconds_total'] / checkouts
+    stats['checkout_seconds_avg'] = stats['checkout_seconds_total'] / checkouts
+    stats['hold_seconds_avg'] = stats['hold_seconds_total'] / checkouts
+    stats['max_size'] = POOL_MAX_SIZE
+    stats['min_size'] = POOL_MIN_SIZE
+    stats['pid'] = os.getpid()
+    return stats
+
+
+def _apply_baseline_tables(cur, partitioned):
+    logging.info("Creating 'customers' table...")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS customers (
+            customer_id SERIAL PRIMARY KEY,
+            name VARCHAR(255),
+            email VARCHAR(255),
+            phone VARCHAR(20),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    logging.info("Creating 'subscriptions' table...")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            subscription_id SERIAL PRIMARY KEY,
+            customer_id INTEGER REFERENCES customers(customer_id),
+            subscription_type VARCHAR(50),
+            start_date DATE,
+            end_date DATE
+        );
+    """)
+    # Partitioned tables need the partition column in their primary key
+    partition_clause = {
+        'payments': ("PRIMARY KEY (payment_id, payment_date)", "PARTITION BY RANGE (payment_date)"),
+        'usage': ("PRIMARY KEY (usage_id, usage_date)", "PARTITION BY RANGE (usage_date)"),
+    } if partitioned else {
+        'payments': ("PRIMARY KEY (payment_id)", ""),
+        'usage': ("PRIMARY KEY (usage_id)", ""),
+    }
+    logging.info(f"Creating 'payments' table{' (partitioned by payment_date)' if partitioned else ''}...")
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS payments (
+            payment_id SERIAL,
+            subscription_id INTEGER REFERENCES subscriptions(subscription_id),
+            payment_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            amount DECIMAL(10, 2),
+            {partition_clause['payments'][0]}
+        ) {partition_clause['payments'][1]};
+    """)
+    logging.info(f"Creating 'usage' table{' (partitioned by usage_date)' if partitioned else ''}...")
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS usage (
+            usage_id SERIAL,
+            subscription_id INTEGER REFERENCES subscriptions(subscription_id),
+            data_usage DECIMAL(10, 2),
+            call_minutes DECIMAL(10, 2),
+            sms_count INTEGER,
+            usage_date DATE NOT NULL DEFAULT CURRENT_DATE,
+            {partition_clause['usage'][0]}
+        ) {partition_clause['usage'][1]};
+    """)
+    # Databases created before usage_date existed; a constant default makes this metadata-only
+    cur.execute("ALTER TABLE usage ADD COLUMN IF NOT EXISTS usage_date DATE NOT NULL DEFAULT CURRENT_DATE;")
+    if partitioned:
+        ensure_partitions(cur)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS payment_amount (
+            id SERIAL PRIMARY KEY,
+            customer_id INT NOT NULL,
+            sum_payment NUMERIC(10, 2) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+
+def _create_index(cur, name, table, columns, unique=False):
+    """CREATE INDEX CONCURRENTLY, so reads and writes continue while it builds.
+
+    A failed concurrent build leaves an INVALID index behind that IF NOT
+    EXISTS would skip, so it is dropped and rebuilt. Partitioned tables do
+    not support CONCURRENTLY and get a regular build.
+    """
+    cur.execute("""
+        SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid
+    """, (name,))
+    if cur.fetchone():
+        logging.warning(f"Dropping invalid index {name} left by an interrupted build...")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
+    cur.execute("SELECT relkind FROM pg_class WHERE relname = %s", (table,))
+    row = cur.fetchone()
+    concurrently = "" if row and row[0] == 'p' else "CONCURRENTLY "
+    cur.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {concurrently}IF NOT EXISTS {name} "
+                f"ON {table} ({columns});")
+
+
+def _apply_indexes(cur, partitioned):
+    logging.info("Creating time-window and foreign-key indexes...")
+    _create_index(cur, 'idx_customers_created_at', 'customers', 'created_at')
+    _create_index(cur, 'idx_subscriptions_start_date', 'subscriptions', 'start_date')
+    _create_index(cur, 'idx_subscriptions_end_date', 'subscriptions', 'end_date')
+    _create_index(cur, 'idx_payments_payment_date', 'payments', 'payment_date')
+    _create_index(cur, 'idx_payment_amount_created_at', 'payment_amount', 'created_at')
+    _create_index(cur, 'idx_usage_usage_date', 'usage', 'usage_date')
+    _create_index(cur, 'idx_subscriptions_customer_id', 'subscriptions', 'customer_id')
+    _create_index(cur, 'idx_payments_subscription_id', 'payments', 'subscription_id')
+    _create_index(cur, 'idx_usage_subscription_id', 'usage', 'subscription_id')
+
+
+def _apply_usage_summary(cur, partitioned):
+    logging.info("Creating 'usage_summary' materialized view...")
+    cur.execute(USAGE_SUMMARY_SQL)
+    # A unique index is what allows REFRESH ... CONCURRENTLY
+    _create_index(cur, 'idx_usage_summary_customer_id', 'usage_summary', 'customer_id', unique=True)
+
+
+def _apply_payment_amount_unique(cur, partitioned):
+    # Required by the ON CONFLICT (customer_id) upserts of the API and the ETL
+    cur.execute("SELECT 1 FROM pg_constraint WHERE conname = 'unique_customer_id'")
+    if cur.fetchone():
+        return
+    logging.info("Removing duplicate payment_amount rows, keeping the latest per customer...")
+    cur.execute("""
+        DELETE FROM payment_amount older USING payment_amount newer
+        WHERE older.customer_id = newer.customer_id AND older.id < newer.id;
+    """)
+    logging.info(f"Removed {cur.rowcount} duplicate rows.")
+    _create_index(cur, 'unique_customer_id', 'payment_amount', 'customer_id', unique=True)
+    cur.execute("ALTER TABLE payment_amount ADD CONSTRAINT unique_customer_id UNIQUE USING INDEX unique_customer_id;")
+
+
+# Tables whose writes bump their row in table_versions, the data version of cached reports
+VERSIONED_TABLES = ('customers', 'subscriptions', 'payments', 'usage', 'payment_amount')
+
+
+def _apply_table_versions(cur, partitioned):
+    logging.info("Creating table_versions and its write triggers...")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        );
+    """)
+    # Runs inside the writer's transaction, so a new version is visible exactly when the write is
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION bump_table_version(name TEXT) RETURNS void AS $$
+            INSERT INTO table_versions (table_name, version) VALUES (name, 1)
+            ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1;
+        $$ LANGUAGE sql;
+    """)
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION table_version_trigger() RETURNS trigger AS $$
+        BEGIN
+            PERFORM bump_table_version(TG_TABLE_NAME);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    for table in VERSIONED_TABLES:
+        cur.execute(f"DROP TRIGGER IF EXISTS {table}_version ON {table};")
+        cur.execute(f"""
+            CREATE TRIGGER {table}_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION table_version_trigger();
         """)
+
+
+# (version, description, transactional, apply(cur, partitioned)); append only, never edit an applied one.
+# Non-transactional migrations (CREATE INDEX CONCURRENTLY) must be safe to re-run after a failure.
+MIGRATIONS = [
+    (1, "baseline tables", True, _apply_baseline_tables),
+    (2, "time-window and foreign-key indexes", False, _apply_indexes),
+    (3, "usage_summary materialized view", False, _apply_usage_summary),
+    (4, "unique payment_amount.customer_id", False, _apply_payment_amount_unique),
+    (5, "table write versions", True, _apply_table_versions),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(partitioned=None):
+    """Apply pending migrations and return the schema version.
+
+    An advisory lock serializes concurrent starters (several app workers,
+    the ETL), and applied versions are recorded in schema_version, so a
+    restart against an up-to-date database only reads that table.
+    Partitioning is decided when the baseline migration runs.
+    """
+    partitioned = PARTITIONED_TABLES if partitioned is None else partitioned
+    conn = get_db_connection()
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
         cur.execute("""
-            CREATE TABLE IF NOT EXISTS payment_amount (
-                id SERIAL PRIMARY KEY,
-                customer_id INT NOT NULL,
-                sum_payment NUMERIC(10, 2) NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                duration_seconds NUMERIC(10, 3)
             );
         """)
-        conn.commit()
-        logging.info("Tables created successfully.")
+        cur.execute("SELECT version FROM schema_version")
+        applied = {row[0] for row in cur.fetchall()}
+        pending = [migration for migration in MIGRATIONS if migration[0] not in applied]
+        if not pending:
+            logging.info(f"Schema is up to date (version {SCHEMA_VERSION}).")
+            return SCHEMA_VERSION
+        for version, description, transactional, apply in pending:
+            logging.info(f"Applying migration {version}: {description}...")
+            started = time.monotonic()
+            conn.autocommit = not transactional
+            apply(cur, partitioned)
+            cur.execute("INSERT INTO schema_version (version, description, duration_seconds) VALUES (%s, %s, %s);",
+                        (version, description, time.monotonic() - started))
+            if transactional:
+                conn.commit()
+                conn.autocommit = True
+            logging.info(f"Migration {version} applied in {time.monotonic() - started:.2f}s.")
+        return SCHEMA_VERSION
     except Exception as e:
-        logging.error(f"Error creating tables: {e}")
+        logging.error(f"Error applying migrations: {e}")
+        if not conn.autocommit:
+            conn.rollback()
+        raise
     finally:
         cur.close()
+        # Closing the session releases the advisory lock
         conn.close()
 
 
-def insert_data_to_db():
-    conn = get_db_connection()
-    cur = conn.cursor()
+def schema_version():
+    """Return the highest applied migration version, or 0 for an unmigrated database."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            return 0
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        version = cur.fetchone()[0]
+        cur.close()
+    return version
 
-    try:
-        logging.info("Inserting customer data...")
-        for _ in range(500):
-            name = ''.join(random.choices(string.ascii_uppercase + string.ascii_lowercase, k=10))
-            email = f"{name.lower()}@example.com"
-            phone = f"+1{random.randint(1000000000, 9999999999)}"
-            cur.execute("""
-            INSERT INTO customers (name, email, phone) 
-            VALUES (%s, %s, %s)
-            """, (name, email, phone))
-        logging.info("Inserted 500 customer records.")
-        logging.info("Inserting subscription data...")
-        for _ in range(500):
-            customer_id = random.randint(1, 500)
-            subscription_type = random.choice(["Basic", "Premium", "Enterprise"])
-            start_date = f"2024-01-01"
-            end_date = f"2025-01-01"
-            cur.execute("""
-            INSERT INTO subscriptions (customer_id, subscription_type, start_date, end_date)
-            VALUES (%s, %s, %s, %s)
-            """, (customer_id, subscription_type, start_date, end_date))
-        logging.info("Inserted 500 subscription records.")
-        logging.info("Inserting payment data...")
-        for _ in range(500):
-            subscription_id = random.randint(1, 500)
-            amount = round(random.uniform(10.0, 100.0), 2)
-            cur.execute("""
-            INSERT INTO payments (subscription_id, amount)
-            VALUES (%s, %s)
-            """, (subscription_id, amount))
-        logging.info("Inserted 500 payment records.")
-        logging.info("Inserting usage data...")
-        for _ in range(500):
-            subscription_id = random.randint(1, 500)
-            data_usage = round(random.uniform(0.1, 10.0), 2)
-            call_minutes = round(random.uniform(1.0, 100.0), 2)
-            sms_count = random.randint(0, 100)
-            cur.execute("""
-            INSERT INTO usage (subscription_id, data_usage, call_minutes, sms_count)
-            VALUES (%s, %s, %s, %s)
-            """, (subscription_id, data_usage, call_minutes, sms_count))
-        logging.info("Inserted 500 usage records.")
 
+def create_tables(partitioned=None):
+    """Drop every table and rebuild the schema from scratch; for development resets only."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        logging.info("Dropping existing tables if any...")
+        cur.execute("DROP TABLE IF EXISTS usage, payments, subscriptions, customers, payment_amount, "
+                    "schema_version CASCADE;")
+        conn.commit()
+        cur.close()
+    migrate(partitioned)
+
+
+def is_empty():
+    """True when no customers exist yet, i.e. the database has not been seeded."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT NOT EXISTS (SELECT 1 FROM customers)")
+        empty = cur.fetchone()[0]
+        cur.close()
+    return empty
+
+
+def _month_start(value, months_ahead=0):
+    month_index = value.year * 12 + value.month - 1 + months_ahead
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _partition_names(cur, table):
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+    """, (table,))
+    return {row[0] for row in cur.fetchall()}
+
+
+def ensure_partitions(cur, months_ahead=None):
+    """Create monthly partitions of payments and usage up to months_ahead months from now.
+
+    Months run from PARTITION_START; anything outside falls into a DEFAULT
+    partition so inserts never fail. A month's partition cannot be created
+    while the default partition holds rows of that month, so those rows are
+    moved out first: the default is detached, the partitions are created,
+    the rows re-inserted through the parent and the default attached again.
+    Run inside a transaction so readers never see the rows missing.
+    """
+    months_ahead = PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    first = _month_start(date.fromisoformat(PARTITION_START))
+    last = _month_start(date.today(), months_ahead)
+    for table, column in PARTITIONED_COLUMNS.items():
+        existing = _partition_names(cur, table)
+        default = f"{table}_default"
+        months = set()
+        month = first
+        while month <= last:
+            months.add(month)
+            month = _month_start(month, 1)
+        stranded = set()
+        if default in existing:
+            # Rows that landed in the default partition because their month had none yet
+            cur.execute(f"SELECT DISTINCT date_trunc('month', {column})::date FROM {default} "
+                        f"WHERE {column} >= %s", (first,))
+            stranded = {row[0] for row in cur.fetchall()}
+            months |= stranded
+        missing = sorted(month for month in months if f"{table}_y{month.year}m{month.month:02d}" not in existing)
+        to_move = [month for month in missing if month in stranded]
+        if to_move:
+            logging.info(f"Detaching {default} to move rows of {len(to_move)} months into their own partitions...")
+            cur.execute(f"ALTER TABLE {table} DETACH PARTITION {default};")
+        for month in missing:
+            next_month = _month_start(month, 1)
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table}_y{month.year}m{month.month:02d}
+                PARTITION OF {table} FOR VALUES FROM ('{month}') TO ('{next_month}');
+            """)
+        if to_move:
+            ranges = " OR ".join(f"({column} >= %s AND {column} < %s)" for _ in to_move)
+            params = [bound for month in to_move for bound in (month, _month_start(month, 1))]
+            cur.execute(f"""
+                WITH moved AS (DELETE FROM {default} WHERE {ranges} RETURNING *)
+                INSERT INTO {table} SELECT * FROM moved;
+            """, params)
+            logging.info(f"Moved {cur.rowcount} rows out of {default}.")
+            cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT;")
+        elif default not in existing:
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {default} PARTITION OF {table} DEFAULT;")
+    logging.info(f"Monthly partitions ensured from {first} to {last}.")
+
+
+def maintain_partitions(months_ahead=None):
+    """Keep the monthly partitions ahead of incoming data; meant for a recurring job.
+
+    Does nothing for a database whose fact tables are not partitioned. Holds
+    the migration lock so it never runs alongside a migration.
+    """
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+            cur.execute("SELECT relname FROM pg_class WHERE relname = ANY(%s) AND relkind = 'p'",
+                        (list(PARTITIONED_COLUMNS),))
+            if len(cur.fetchall()) < len(PARTITIONED_COLUMNS):
+                logging.info("payments and usage are not partitioned; nothing to maintain.")
+                conn.rollback()
+                return
+            ensure_partitions(cur, months_ahead)
+            conn.commit()
+        except Exception as e:
+            logging.error(f"Error maintaining partitions: {e}")
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+
+def refresh_usage_summary(concurrently=True):
+    """Recompute usage_summary; a concurrent refresh does not block readers."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        started = time.monotonic()
+        cur.execute(f"REFRESH MATERIALIZED VIEW {'CONCURRENTLY ' if concurrently else ''}usage_summary;")
+        # Materialized views have no triggers
+        cur.execute("SELECT bump_table_version('usage_summary')")
         conn.commit()
-        logging.info("Data insertion completed successfully.")
+        cur.close()
+    logging.info(f"Refreshed usage_summary in {time.monotonic() - started:.2f}s.")
+
+
+def _random_name(rng):
+    return ''.join(rng.choices(string.ascii_uppercase + string.ascii_lowercase, k=10))
+
+
+def _generate_rows(table, first_id, count, rng, parent_range):
+    """Yield tab-separated COPY lines for ids first_id .. first_id + count - 1."""
+    parent_low, parent_high = parent_range or (0, 0)
+    for row_id in range(first_id, first_id + count):
+        if table == 'customers':
+            name = _random_name(rng)
+            yield f"{row_id}\t{name}\t{name.lower()}@example.com\t+1{rng.randint(1000000000, 9999999999)}\n"
+        elif table == 'subscriptions':
+            subscription_type = rng.choice(SUBSCRIPTION_TYPES)
+            yield f"{row_id}\t{rng.randint(parent_low, parent_high)}\t{subscription_type}\t2024-01-01\t2025-01-01\n"
+        elif table == 'payments':
+            yield f"{row_id}\t{rng.randint(parent_low, parent_high)}\t{rng.uniform(10.0, 100.0):.2f}\n"
+        elif table == 'usage':
+            yield (f"{row_id}\t{rng.randint(parent_low, parent_high)}\t{rng.uniform(0.1, 10.0):.2f}"
+                   f"\t{rng.uniform(1.0, 100.0):.2f}\t{rng.randint(0, 100)}\n")
+
+
+def _copy_chunk(table, first_id, count, seed, parent_range):
+    """COPY one chunk of generated rows on its own connection; safe to run in a worker process.
+
+    Each chunk seeds its own generator from (seed, table, first_id), so a
+    given seed produces the same data whatever the number of workers.
+    """
+    rng = random.Random(f"{seed}:{table}:{first_id}" if seed is not None else None)
+    buffer = io.StringIO()
+    buffer.writelines(_generate_rows(table, first_id, count, rng, parent_range))
+    buffer.seek(0)
+
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        columns = ', '.join(COPY_COLUMNS[table])
+        cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN", buffer)
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    return count
+
+
+def _max_id(cur, table):
+    cur.execute(f"SELECT COALESCE(MAX({COPY_COLUMNS[table][0]}), 0) FROM {table}")
+    return cur.fetchone()[0]
+
+
+def insert_data_to_db(row_counts=None, seed=None, workers=1, chunk_rows=None):
+    """Generate synthetic data and bulk load it with COPY ... FROM STDIN.
+
+    row_counts maps table name to the number of rows to add (defaults come
+    from the SEED_<TABLE>_ROWS environment variables). Rows are generated in
+    chunks of chunk_rows and each chunk is streamed with one COPY; with
+    workers > 1 chunks are loaded by that many processes in parallel.
+    Primary keys are assigned up front, so foreign keys always point at
+    customers/subscriptions that exist.
+    """
+    row_counts = {**DEFAULT_ROW_COUNTS, **(row_counts or {})}
+    chunk_rows = chunk_rows or COPY_CHUNK_ROWS
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        first_ids = {table: _max_id(cur, table) + 1 for table in COPY_COLUMNS}
+        cur.close()
+
+    def id_range(table):
+        if row_counts[table] > 0:
+            return first_ids[table], first_ids[table] + row_counts[table] - 1
+        return 1, first_ids[table] - 1
+
+    parent_ranges = {
+        'customers': None,
+        'subscriptions': id_range('customers'),
+        'payments': id_range('subscriptions'),
+        'usage': id_range('subscriptions'),
+    }
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        # Children must exist before the rows referencing them are loaded
+        for stage in (['customers'], ['subscriptions'], ['payments', 'usage']):
+            started = time.monotonic()
+            jobs = []
+            for table in stage:
+                if row_counts[table] > 0 and parent_ranges[table] and parent_ranges[table][1] < 1:
+                    raise ValueError(f"Cannot generate {table} without any parent rows")
+                for offset in range(0, row_counts[table], chunk_rows):
+                    count = min(chunk_rows, row_counts[table] - offset)
+                    args = (table, first_ids[table] + offset, count, seed, parent_ranges[table])
+                    jobs.append(executor.submit(_copy_chunk, *args) if executor else _copy_chunk(*args))
+            loaded = sum(job.result() if executor else job for job in jobs)
+            elapsed = time.monotonic() - started
+            logging.info(f"Loaded {loaded} rows into {', '.join(stage)} in {elapsed:.1f}s "
+                         f"({loaded / max(elapsed, 1e-9):.0f} rows/s).")
     except Exception as e:
         logging.error(f"Error inserting data: {e}")
+        raise
     finally:
+        if executor:
+            executor.shutdown()
+
+    # Explicit ids bypass the serial sequences, so move them past the new rows
+    with db_connection() as conn:
+        cur = conn.cursor()
+        for table, columns in COPY_COLUMNS.items():
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', '{columns[0]}'), "
+                        f"GREATEST((SELECT MAX({columns[0]}) FROM {table}), 1))")
+        conn.commit()
         cur.close()
-        conn.close()
+    logging.info("Data insertion completed successfully.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed the database with synthetic data using COPY.")
+    for table in COPY_COLUMNS:
+        parser.add_argument(f"--{table}", type=int, default=DEFAULT_ROW_COUNTS[table],
+                            help=f"number of {table} rows to generate")
+    parser.add_argument("--seed", type=int, default=None, help="seed for reproducible data")
+    parser.add_argument("--workers", type=int, default=1, help="parallel COPY worker processes")
+    parser.add_argument("--chunk-rows", type=int, default=COPY_CHUNK_ROWS, help="rows per COPY chunk")
+    parser.add_argument("--create-tables", action="store_true", help="drop and recreate the tables first")
+    parser.add_argument("--migrate", action="store_true", help="apply pending migrations and exit")
+    parser.add_argument("--ensure-partitions", action="store_true",
+                        help="create upcoming monthly partitions, moving rows out of the default partition, and exit")
+    args = parser.parse_args()
+
+    if args.migrate:
+        migrate()
+        raise SystemExit(0)
+    if args.ensure_partitions:
+        maintain_partitions()
+        raise SystemExit(0)
+    if args.create_tables:
+        create_tables()
+    else:
+        migrate()
+    insert_data_to_db({table: getattr(args, table) for table in COPY_COLUMNS},
+                      seed=args.seed, workers=args.workers, chunk_rows=args.chunk_rows)
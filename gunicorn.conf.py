@@ -0,0 +1,89 @@
+import logging
+import multiprocessing
+import os
+import sys
+
+# Production server settings for `gunicorn -c gunicorn.conf.py wsgi:application`.
+# Every setting can be overridden through the environment.
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5001')
+worker_class = 'gthread'
+# Each thread holds at most one pooled connection, so keep threads <= DB_POOL_MAX_SIZE
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+# Postgres connections this server may hold in total; the rest of max_connections (100 by default)
+# is left to the async API, Airflow and the ETL
+DB_CONNECTION_BUDGET = int(os.getenv('DB_CONNECTION_BUDGET', '40'))
+# Connections one worker can hold at once: one per thread, capped by its pool
+CONNECTIONS_PER_WORKER = min(threads, int(os.getenv('DB_POOL_MAX_SIZE', '10')))
+# Requests are mostly waiting on Postgres, so use several processes, each with a few threads,
+# but no more than the connection budget allows
+workers = int(os.getenv('GUNICORN_WORKERS', str(max(1, min(multiprocessing.cpu_count() * 2 + 1,
+                                                           DB_CONNECTION_BUDGET // CONNECTIONS_PER_WORKER)))))
+# Seconds an idle keep-alive connection stays open for the next request
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+# A worker silent for this long is killed and replaced; /export streams keep it alive
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+# On SIGTERM/SIGHUP, workers stop accepting and get this long to finish in-flight requests
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+# Recycle workers now and then to bound memory growth; jitter avoids restarting them all at once
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '10000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '1000'))
+# Import the app once in the master and fork it, sharing its memory copy-on-write
+preload_app = True
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+# Workers share their request metrics through this directory so any of them can answer /metrics;
+# tmpfs keeps the writes off disk
+os.environ.setdefault('API_METRICS_DIR', '/dev/shm/api_metrics')
+# Without a shared backend each worker would cache privately and an invalidation would only
+# reach the worker that received it, so the response cache is off unless API_CACHE_URL is set
+if workers > 1 and not os.getenv('API_CACHE_URL'):
+    os.environ.setdefault('API_CACHE_ENABLED', 'false')
+
+
+def on_starting(server):
+    """Migrate and seed once in the master, before any worker is forked."""
+    from app import prepare_database
+    from db_utils import close_pool, POOL_MAX_SIZE
+    import metrics
+
+    from response_cache import CACHE_ENABLED, CACHE_URL
+
+    if threads > POOL_MAX_SIZE:
+        server.log.warning(f"GUNICORN_THREADS={threads} exceeds DB_POOL_MAX_SIZE={POOL_MAX_SIZE}; "
+                           f"requests will queue for connections.")
+    if workers * CONNECTIONS_PER_WORKER > DB_CONNECTION_BUDGET:
+        server.log.warning(f"{workers} workers x {CONNECTIONS_PER_WORKER} connections exceeds "
+                           f"DB_CONNECTION_BUDGET={DB_CONNECTION_BUDGET}; Postgres may refuse connections.")
+    if workers > 1 and CACHE_ENABLED and not CACHE_URL:
+        server.log.warning("Response cache is per worker without API_CACHE_URL; invalidations only reach "
+                           "the worker that receives them.")
+    # Counters restart with the server, so drop the files of the previous run
+    metrics.clear()
+    prepare_database()
+    # Workers open their own connections; none may be inherited across fork
+    close_pool()
+
+
+def post_worker_init(worker):
+    """Open this worker's pool and refuse to serve against an older schema."""
+    from db_utils import SCHEMA_VERSION, get_pool, schema_version
+
+    get_pool()
+    version = schema_version()
+    if version < SCHEMA_VERSION:
+        logging.error(f"Worker {worker.pid}: database schema is at version {version}, "
+                      f"expected {SCHEMA_VERSION}; stopping.")
+        # Exit code 3 (WORKER_BOOT_ERROR) makes the master shut down instead of respawning
+        sys.exit(3)
+    logging.info(f"Worker {worker.pid} ready (schema version {version}).")
+
+
+def worker_exit(server, worker):
+    from db_utils import close_pool
+    import metrics
+
+    close_pool()
+    # Keep the exiting worker's final counts in the totals, in one file shared by all exited workers
+    metrics.retire()
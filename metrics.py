@@ -0,0 +1,335 @@
+import contextvars
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Request metrics for the API, exposed by GET /metrics in the Prometheus
+# text format and logged as one JSON line per request.
+
+# Directory where every gunicorn worker writes its metrics so /metrics reports all of them;
+# empty keeps metrics per process
+METRICS_DIR = os.getenv('API_METRICS_DIR', '')
+# Seconds between writes of this process's metrics to METRICS_DIR
+METRICS_FLUSH_SECONDS = float(os.getenv('API_METRICS_FLUSH_SECONDS', '1'))
+# Totals of exited processes, kept in METRICS_DIR next to the live ones
+RETIRED_FILE = "metrics-retired.json"
+# Log one JSON line with the timings of every request
+METRICS_LOG_REQUESTS = os.getenv('API_METRICS_LOG_REQUESTS', 'true').lower() == 'true'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# Timings accumulated by the request being handled in this thread or task
+PHASES = ("db", "serialize", "pool_wait")
+
+request_logger = logging.getLogger("metrics.requests")
+
+_lock = threading.Lock()
+_metrics = {}
+_flusher_pid = None
+_retired = False
+_current = contextvars.ContextVar("metrics_request", default=None)
+
+
+class Counter:
+    """Monotonic counter with labels."""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.series = {}
+        _metrics[name] = self
+
+    def inc(self, value=1, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with _lock:
+            self.series[key] = self.series.get(key, 0) + value
+        _ensure_flusher()
+
+    def snapshot(self):
+        return {json.dumps(key): value for key, value in self.series.items()}
+
+    def merge(self, totals, values):
+        for key, value in values.items():
+            totals[key] = totals.get(key, 0) + value
+
+    def render(self, series):
+        for key, value in sorted(series.items()):
+            yield f"{self.name}{_labels(self.labels, json.loads(key))} {_number(value)}"
+
+
+class Histogram:
+    """Histogram with labels; buckets are upper bounds, +Inf is added."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        _metrics[name] = self
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        with _lock:
+            counts = self.series.get(key)
+            if counts is None:
+                # One count per bucket plus +Inf, then the sum of observed values
+                counts = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+        _ensure_flusher()
+
+    def snapshot(self):
+        return {json.dumps(key): list(counts) for key, counts in self.series.items()}
+
+    def merge(self, totals, values):
+        for key, counts in values.items():
+            if key in totals:
+                totals[key] = [a + b for a, b in zip(totals[key], counts)]
+            else:
+                totals[key] = list(counts)
+
+    def render(self, series):
+        for key, counts in sorted(series.items()):
+            label_values = json.loads(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                yield f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + [le])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, label_values)} {_number(counts[-1])}"
+            yield f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REQUEST_DURATION = Histogram(
+    "api_request_duration_seconds", "Time from request start to response, by endpoint, method and status.",
+    ("endpoint", "method", "status"))
+REQUEST_PHASE = Histogram(
+    "api_request_phase_seconds", "Time spent per request in database queries, JSON serialization and pool wait.",
+    ("endpoint", "phase"))
+ROWS_RETURNED = Histogram(
+    "api_rows_returned", "Rows returned per response.", ("endpoint",), buckets=ROW_BUCKETS)
+POOL_WAIT = Histogram("db_pool_wait_seconds", "Time spent waiting for a pooled database connection.")
+POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Requests that gave up waiting for a pooled connection.")
+EXPORT_ROWS = Counter("api_export_rows_total", "Rows streamed by /export.", ("table",))
+
+
+def start_request():
+    """Begin collecting the timings of the request handled by the calling thread or task."""
+    _current.set({"started": time.perf_counter(), "rows": 0, **{phase: 0.0 for phase in PHASES}})
+
+
+def add(name, value):
+    """Add value to a timing or to the row count of the current request; a no-op outside requests."""
+    timings = _current.get()
+    if timings is not None:
+        timings[name] += value
+
+
+@contextmanager
+def phase(name):
+    """Time a block as part of the current request's phase name."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, time.perf_counter() - started)
+
+
+def finish_request(endpoint, method, status):
+    """Record the current request's timings and return them, or None if none were started."""
+    timings = _current.get()
+    if timings is None:
+        return None
+    _current.set(None)
+    duration = time.perf_counter() - timings["started"]
+    REQUEST_DURATION.observe(duration, endpoint=endpoint, method=method, status=status)
+    for name in PHASES:
+        REQUEST_PHASE.observe(timings[name], endpoint=endpoint, phase=name)
+    ROWS_RETURNED.observe(timings["rows"], endpoint=endpoint)
+    record = {
+        "event": "request",
+        "endpoint": endpoint,
+        "method": method,
+        "status": status,
+        "duration_seconds": round(duration, 6),
+        **{f"{name}_seconds": round(timings[name], 6) for name in PHASES},
+        "rows": timings["rows"],
+    }
+    if METRICS_LOG_REQUESTS:
+        request_logger.info(json.dumps(record))
+    return record
+
+
+def _snapshot():
+    with _lock:
+        return {name: metric.snapshot() for name, metric in _metrics.items()}
+
+
+def flush():
+    """Write this process's metrics to METRICS_DIR, atomically, if one is configured."""
+    if not METRICS_DIR or _retired:
+        return
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"metrics-{os.getpid()}.json")
+        # The flush thread and /metrics may write at the same time, so each uses its own temp file
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(_snapshot(), f)
+        with _lock:
+            # retire() may have folded this process into the retired totals meanwhile
+            if _retired:
+                os.remove(tmp_path)
+                return
+            os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning(f"Could not write metrics to {METRICS_DIR}: {e}")
+
+
+def _flush_forever():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        flush()
+
+
+def _ensure_flusher():
+    # One background writer per process, started on first use so forked workers get their own
+    global _flusher_pid
+    if not METRICS_DIR or _flusher_pid == os.getpid():
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_forever, name="metrics-flush", daemon=True).start()
+
+
+def _reset_after_fork():
+    # A forked worker starts from zero; what the parent recorded stays in the parent's file
+    global _lock, _flusher_pid, _retired
+    _lock = threading.Lock()
+    _flusher_pid = None
+    _retired = False
+    for metric in _metrics.values():
+        metric.series = {}
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def clear():
+    """Delete the metrics files of earlier processes; call once before workers start."""
+    if not METRICS_DIR:
+        return
+    for path in glob.glob(os.path.join(METRICS_DIR, "metrics-*.json*")):
+        os.remove(path)
+
+
+@contextmanager
+def _files_lock(mode):
+    # Serializes retire() against readers, so a scrape never sees a worker both in its own
+    # file and in the retired totals, or in neither
+    with open(os.path.join(METRICS_DIR, "metrics.lock"), "a") as f:
+        fcntl.flock(f, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Skipping unreadable metrics file {path}: {e}")
+        return {}
+
+
+def retire():
+    """Fold this process's metrics into the cumulative retired file and delete its own file.
+
+    Call when a worker exits: the directory then holds one file per live
+    worker plus RETIRED_FILE, however often workers are recycled.
+    """
+    global _retired
+    if not METRICS_DIR:
+        return
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with _files_lock(fcntl.LOCK_EX):
+            with _lock:
+                _retired = True
+            retired_path = os.path.join(METRICS_DIR, RETIRED_FILE)
+            totals = _load(retired_path)
+            for name, values in _snapshot().items():
+                _metrics[name].merge(totals.setdefault(name, {}), values)
+            tmp_path = f"{retired_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(totals, f)
+            os.replace(tmp_path, retired_path)
+            pid_path = os.path.join(METRICS_DIR, f"metrics-{os.getpid()}.json")
+            if os.path.exists(pid_path):
+                os.remove(pid_path)
+    except OSError as e:
+        logging.warning(f"Could not retire metrics to {METRICS_DIR}: {e}")
+
+
+def render():
+    """Return every metric in the Prometheus text exposition format (version 0.0.4).
+
+    With METRICS_DIR set the series of all live processes are summed with
+    the retired totals of workers that have exited, so counters never go
+    backwards when gunicorn recycles a worker.
+    """
+    snapshots = []
+    if METRICS_DIR:
+        flush()
+        with _files_lock(fcntl.LOCK_SH):
+            for path in glob.glob(os.path.join(METRICS_DIR, "metrics-*.json")):
+                snapshots.append(_load(path))
+    else:
+        snapshots.append(_snapshot())
+
+    lines = []
+    for name, metric in _metrics.items():
+        series = {}
+        for snapshot in snapshots:
+            metric.merge(series, snapshot.get(name, {}))
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        lines.extend(metric.render(series))
+    return "\n".join(lines) + "\n"
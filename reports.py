@@ -0,0 +1,288 @@
+import argparse
+import csv
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from api_common import AGGREGATES, parse_window
+from db_utils import db_connection
+from sql_queries import COMPRESSION_SUFFIXES, open_csv_output
+
+# Cached report results live here, one gzip JSON file per report+params, named with its data version
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", "/tmp/report_cache")
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", 4))
+
+# name -> {"query", "defaults", "tables", "description", "prepare"}
+REPORTS = {}
+
+
+def register_report(name, query, defaults=None, tables=(), description="", prepare=None):
+    """Register a named SQL report.
+
+    query uses %(param)s placeholders; defaults supplies every parameter
+    the query needs. tables lists the relations the report reads, which
+    determines its data version for caching. prepare, if given, turns the
+    parameters into the values bound to the query.
+    """
+    REPORTS[name] = {
+        "query": query,
+        "defaults": dict(defaults or {}),
+        "tables": tuple(tables),
+        "description": description,
+        "prepare": prepare,
+    }
+
+
+register_report(
+    "avg_usage",
+    """
+        SELECT
+            customer_id,
+            ROUND(avg_call_minutes, %(precision)s) AS avg_call_minutes,
+            ROUND(avg_data_usage, %(precision)s) AS avg_data_usage,
+            ROUND(avg_sms_count, %(precision)s) AS avg_sms_count
+        FROM usage_summary
+        ORDER BY customer_id
+    """,
+    defaults={"precision": 2},
+    tables=("usage_summary",),
+    description="Average call minutes, data usage and SMS count per customer",
+)
+
+def _window_params(params):
+    # The bounds GET /aggregates/<name> uses: a date-only end_date includes that whole day
+    lower, upper = parse_window({key: None if value is None else str(value) for key, value in params.items()})
+    return {"start_date": lower, "end_date": upper}
+
+
+def aggregate_report(name, description):
+    """Register a report over an API aggregate (api_common.AGGREGATES), grouped by its default grouping.
+
+    The report and GET /aggregates/<name> share one query and window
+    bounds, so for the same start_date/end_date both return the same rows.
+    """
+    aggregate = AGGREGATES[name]
+    group_by, (expression, _) = next(iter(aggregate["group_by"].items()))
+    time_column = aggregate["time_column"]
+    query = aggregate["query"].format(
+        group=f"{expression} AS {group_by}",
+        window=f"AND {time_column} >= COALESCE(%(start_date)s::timestamp, '-infinity') "
+               f"AND {time_column} < COALESCE(%(end_date)s::timestamp, 'infinity')",
+    )
+    register_report(name, f"{query} ORDER BY 1", defaults={"start_date": None, "end_date": None},
+                    tables=aggregate["tables"], description=description, prepare=_window_params)
+
+
+aggregate_report("payment_totals", "Total payments per customer, optionally within a payment_date window")
+aggregate_report("revenue_by_subscription_type",
+                 "Revenue per subscription type, optionally within a payment_date window")
+
+
+def data_version(cur, tables):
+    """Fingerprint the current contents of tables from their write versions.
+
+    Every write statement on a table bumps its row in table_versions
+    inside the writer's transaction, as does a usage_summary refresh, so
+    the version changes exactly when a committed write becomes visible.
+    """
+    cur.execute("""
+        SELECT table_name, version FROM table_versions
+        WHERE table_name = ANY(%s)
+        ORDER BY table_name
+    """, (list(tables),))
+    return hashlib.sha256(repr(cur.fetchall()).encode()).hexdigest()[:16]
+
+
+def _cache_path(name, params, version):
+    key = json.dumps([name, params], sort_keys=True, default=str)
+    return os.path.join(REPORT_CACHE_DIR, f"{name}-{hashlib.sha256(key.encode()).hexdigest()[:24]}-{version}.json.gz")
+
+
+def _read_cache(path):
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, "rt") as f:
+        cached = json.load(f)
+    return cached["columns"], cached["rows"]
+
+
+def _write_cache(path, columns, rows):
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with gzip.open(tmp_path, "wt") as f:
+        json.dump({"columns": columns, "rows": rows}, f, default=str)
+    os.replace(tmp_path, path)
+    # Results of older data versions of the same report and parameters can never be read again
+    prefix = path[:-len(".json.gz")].rsplit("-", 1)[0]
+    for stale_path in glob.glob(f"{prefix}-*.json.gz"):
+        if stale_path != path:
+            try:
+                os.remove(stale_path)
+            except FileNotFoundError:
+                pass
+
+
+def csv_sink(output_dir, compression="none"):
+    """Write each report to <output_dir>/<report>.csv[.gz|.zst] with a header, atomically."""
+    def write(name, columns, rows):
+        path = os.path.join(output_dir, f"{name}.csv{COMPRESSION_SUFFIXES[compression]}")
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        os.makedirs(output_dir, exist_ok=True)
+        with open_csv_output(tmp_path, compression) as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(rows)
+        os.replace(tmp_path, path)
+        return path
+    return write
+
+
+def ndjson_sink(output_dir):
+    """Write each report to <output_dir>/<report>.ndjson, one JSON object per row, atomically."""
+    def write(name, columns, rows):
+        path = os.path.join(output_dir, f"{name}.ndjson")
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        os.makedirs(output_dir, exist_ok=True)
+        with open(tmp_path, "w") as f:
+            for row in rows:
+                f.write(json.dumps(dict(zip(columns, row)), default=str) + "\n")
+        os.replace(tmp_path, path)
+        return path
+    return write
+
+
+def table_sink(table, key_columns):
+    """Upsert each report's rows into an existing table keyed on key_columns, like payment_amount."""
+    def write(name, columns, rows):
+        query = sql.SQL("INSERT INTO {} ({}) VALUES %s ON CONFLICT ({}) DO UPDATE SET {}").format(
+            sql.Identifier(table),
+            sql.SQL(", ").join(map(sql.Identifier, columns)),
+            sql.SQL(", ").join(map(sql.Identifier, key_columns)),
+            sql.SQL(", ").join(
+                sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(column))
+                for column in columns if column not in key_columns
+            ),
+        )
+        with db_connection() as conn:
+            cur = conn.cursor()
+            execute_values(cur, query.as_string(conn), rows, page_size=1000)
+            conn.commit()
+            cur.close()
+        return table
+    return write
+
+
+SINKS = {
+    "csv": csv_sink,
+    "ndjson": ndjson_sink,
+    "table": table_sink,
+}
+
+
+def run_report(name, params=None, sinks=(), use_cache=True):
+    """Run one report and hand its rows to every sink. Returns a timing summary."""
+    report = REPORTS[name]
+    unknown = set(params or {}) - set(report["defaults"])
+    if unknown:
+        raise ValueError(f"Unknown parameters for {name}: {sorted(unknown)}")
+    params = {**report["defaults"], **(params or {})}
+    query_params = report["prepare"](params) if report["prepare"] else params
+    started = time.monotonic()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        version = data_version(cur, report["tables"])
+        cache_path = _cache_path(name, params, version)
+        cached = _read_cache(cache_path) if use_cache else None
+        if cached is not None:
+            columns, rows = cached
+        else:
+            cur.execute(report["query"], query_params)
+            columns = [desc[0] for desc in cur.description]
+            rows = cur.fetchall()
+        cur.close()
+    query_seconds = time.monotonic() - started
+    if cached is None and use_cache:
+        _write_cache(cache_path, columns, rows)
+
+    sink_started = time.monotonic()
+    outputs = [sink(name, columns, rows) for sink in sinks]
+    summary = {
+        "report": name,
+        "params": params,
+        "data_version": version,
+        "cached": cached is not None,
+        "rows": len(rows),
+        "query_seconds": round(query_seconds, 3),
+        "sink_seconds": round(time.monotonic() - sink_started, 3),
+        "outputs": outputs,
+    }
+    logging.info(f"Report {name}: {summary['rows']} rows, {'cache hit' if summary['cached'] else 'queried'} "
+                 f"in {summary['query_seconds']}s, sinks {summary['sink_seconds']}s")
+    return summary
+
+
+def run_reports(jobs, workers=REPORT_WORKERS, use_cache=True):
+    """Run [(name, params, sinks), ...] concurrently over the shared connection pool.
+
+    Failures are logged and reported per job instead of aborting the batch.
+    """
+    started = time.monotonic()
+    summaries = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            (name, params, executor.submit(run_report, name, params, sinks, use_cache))
+            for name, params, sinks in jobs
+        ]
+        for name, params, future in futures:
+            try:
+                summaries.append(future.result())
+            except Exception as e:
+                logging.error(f"Report {name} failed: {e}")
+                summaries.append({"report": name, "params": params, "error": str(e)})
+    logging.info(f"Ran {len(jobs)} reports in {time.monotonic() - started:.2f}s.")
+    return summaries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run registered SQL reports.")
+    parser.add_argument("reports", nargs="*", help="report names (default: all)")
+    parser.add_argument("--param", action="append", default=[], metavar="KEY=VALUE",
+                        help="parameter applied to every report that accepts it")
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    parser.add_argument("--compression", choices=list(COMPRESSION_SUFFIXES), default="none")
+    parser.add_argument("--output-dir", default=os.getenv("REPORT_OUTPUT_DIR", "/tmp/reports"))
+    parser.add_argument("--workers", type=int, default=REPORT_WORKERS)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--list", action="store_true", help="list registered reports and exit")
+    args = parser.parse_args()
+
+    if args.list:
+        for report_name, report in sorted(REPORTS.items()):
+            print(f"{report_name}: {report['description']} (params: {', '.join(report['defaults']) or '-'})")
+        raise SystemExit(0)
+
+    cli_params = dict(item.split("=", 1) for item in args.param)
+    if args.format == "csv":
+        sink = csv_sink(args.output_dir, args.compression)
+    else:
+        sink = ndjson_sink(args.output_dir)
+    names = args.reports or sorted(REPORTS)
+    unknown_reports = [report_name for report_name in names if report_name not in REPORTS]
+    if unknown_reports:
+        parser.error(f"unknown reports: {', '.join(unknown_reports)}")
+    jobs = [
+        (report_name, {k: v for k, v in cli_params.items() if k in REPORTS[report_name]["defaults"]}, [sink])
+        for report_name in names
+    ]
+    results = run_reports(jobs, workers=args.workers, use_cache=not args.no_cache)
+    print(json.dumps(results, indent=2, default=str))
+    if any("error" in result for result in results):
+        raise SystemExit(1)
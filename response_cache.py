@@ -0,0 +1,226 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, make_response, request
+
+# Redis is only needed when a shared backend is configured
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Set to false to bypass the cache entirely
+CACHE_ENABLED = os.getenv('API_CACHE_ENABLED', 'true').lower() == 'true'
+# Seconds a cached response is served before it is rebuilt; bounds staleness for writes that skip invalidation
+CACHE_TTL_SECONDS = float(os.getenv('API_CACHE_TTL_SECONDS', '60'))
+# Responses kept in each process's LRU
+CACHE_MAX_ENTRIES = int(os.getenv('API_CACHE_MAX_ENTRIES', '1024'))
+# Larger responses are served with an ETag but not stored
+CACHE_MAX_BODY_BYTES = int(os.getenv('API_CACHE_MAX_BODY_BYTES', str(1024 * 1024)))
+# Shared backend (redis://host:port/db) so every worker sees the same entries and invalidations
+CACHE_URL = os.getenv('API_CACHE_URL', '')
+
+
+class LocalBackend:
+    """In-process LRU with per-entry TTL; also the stand-in for the shared backend.
+
+    Generation counters live outside the LRU so eviction can never roll
+    them back and resurrect invalidated entries.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def counters(self, names):
+        with self._lock:
+            return [self._counters.get(name, 0) for name in names]
+
+    def incr(self, name):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+            return self._counters[name]
+
+
+class RedisBackend:
+    """Shared backend on Redis with the same interface as LocalBackend."""
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("API_CACHE_URL requires the redis package")
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, key):
+        raw = self.client.get(f"cache:{key}")
+        if raw is None:
+            return None
+        header, body = raw.split(b"\n", 1)
+        etag, mimetype = json.loads(header)
+        return etag, mimetype, body
+
+    def set(self, key, value, ttl):
+        etag, mimetype, body = value
+        self.client.set(f"cache:{key}", json.dumps([etag, mimetype]).encode() + b"\n" + body, ex=max(int(ttl), 1))
+
+    def counters(self, names):
+        return [int(value or 0) for value in self.client.mget([f"gen:{name}" for name in names])]
+
+    def incr(self, name):
+        return self.client.incr(f"gen:{name}")
+
+
+_local = LocalBackend()
+_shared = RedisBackend(CACHE_URL) if CACHE_URL else None
+# Tables whose responses are cached; invalidate() without arguments bumps them all
+_tables = set()
+_stats = {"hits": 0, "misses": 0, "not_modified": 0, "errors": 0, "invalidations": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cache_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["backend"] = "redis" if _shared is not None else "local"
+    stats["local_entries"] = len(_local._entries)
+    return stats
+
+
+def _generations(tables):
+    backend = _shared if _shared is not None else _local
+    return backend.counters(tables)
+
+
+def cache_key(tables):
+    """Key a GET by path, query parameters and the current generation of the tables it reads."""
+    args = sorted(request.args.items(multi=True))
+    raw = json.dumps([request.path, args, sorted(tables), _generations(sorted(tables))])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _lookup(key):
+    entry = _local.get(key)
+    if entry is None and _shared is not None:
+        entry = _shared.get(key)
+        if entry is not None:
+            _local.set(key, entry, CACHE_TTL_SECONDS)
+    return entry
+
+
+def _store(key, entry):
+    _local.set(key, entry, CACHE_TTL_SECONDS)
+    if _shared is not None:
+        _shared.set(key, entry, CACHE_TTL_SECONDS)
+
+
+def invalidate(tables=None):
+    """Drop cached responses of the given tables (all cached tables by default).
+
+    Entries are not deleted; bumping the table's generation changes every
+    key that depends on it, so other workers stop using them on their next
+    request and the old entries age out of the LRU.
+    """
+    tables = sorted(_tables if tables is None else set(tables))
+    backend = _shared if _shared is not None else _local
+    try:
+        for table in tables:
+            backend.incr(table)
+    except Exception as e:
+        # The write already happened; entries expire after CACHE_TTL_SECONDS regardless
+        _count("errors")
+        logging.warning(f"Could not invalidate cached responses for {', '.join(tables)}: {e}")
+        return []
+    _count("invalidations")
+    logging.info(f"Invalidated cached responses for {', '.join(tables) or 'no tables'}.")
+    return tables
+
+
+def _etag(body):
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+def _respond(entry, status):
+    etag, mimetype, body = entry
+    if request.if_none_match.contains(etag):
+        _count("not_modified")
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    # Clients may keep the body but must revalidate it with If-None-Match
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Cache"] = status
+    return response
+
+
+def cached_response(*tables):
+    """Serve GET responses of a view from the cache, keyed on the tables it reads.
+
+    Only 200 responses are stored. Every response carries an ETag, and a
+    matching If-None-Match gets an empty 304. Backend errors are logged
+    and the view is called directly.
+    """
+    _tables.update(tables)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or not CACHE_ENABLED:
+                return view(*args, **kwargs)
+            try:
+                key = cache_key(tables)
+                entry = _lookup(key)
+            except Exception as e:
+                _count("errors")
+                logging.warning(f"Response cache unavailable, serving uncached: {e}")
+                return view(*args, **kwargs)
+            if entry is not None:
+                _count("hits")
+                return _respond(entry, "HIT")
+
+            _count("misses")
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            body = response.get_data()
+            entry = (_etag(body), response.mimetype, body)
+            if len(body) <= CACHE_MAX_BODY_BYTES:
+                try:
+                    _store(key, entry)
+                except Exception as e:
+                    _count("errors")
+                    logging.warning(f"Could not store cached response: {e}")
+            return _respond(entry, "MISS")
+        return wrapper
+    return decorator
@@ -1,9 +1,17 @@
 import psycopg2
 import csv
+import gzip
+import io
 import logging
 from dotenv import load_dotenv
 import os
 
+# zstd output is optional
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # Database configuration
 DB_CONFIG = {
     "host": os.getenv("POSTGRES_HOST", "localhost"),
@@ -13,6 +21,16 @@ DB_CONFIG = {
     "password": os.getenv("POSTGRES_PASSWORD", "postgres"),
 }
 
+# Rows fetched per round trip when streaming query results
+FETCH_BATCH_SIZE = int(os.getenv("FETCH_BATCH_SIZE", 10000))
+
+# avg_usage CSV output: decimal places, compression ("none", "gzip" or "zstd")
+# and whether to use COPY ... TO STDOUT instead of a server-side cursor
+CSV_PRECISION = int(os.getenv("CSV_PRECISION", 2))
+CSV_COMPRESSION = os.getenv("CSV_COMPRESSION", "none")
+CSV_USE_COPY = os.getenv("CSV_USE_COPY", "false").lower() == "true"
+COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
 # Logging configuration
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
@@ -27,46 +45,92 @@ def get_db_connection():
         raise
 
 
-def avg_usage():
+def open_csv_output(path, compression="none"):
+    """Open a text stream for CSV output, optionally gzip- or zstd-compressed."""
+    if compression == "gzip":
+        return gzip.open(path, "wt", newline="")
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("CSV_COMPRESSION=zstd requires the zstandard package")
+        raw = open(path, "wb")
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(raw, closefd=True), newline="")
+    if compression == "none":
+        return open(path, "w", newline="")
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def export_query_csv(query, params, header, output_path, compression="none", use_copy=False):
+    """Stream a query's rows into a CSV file that appears atomically.
+
+    Rows are written as they arrive from a server-side cursor (or from
+    COPY (query) TO STDOUT with use_copy, the fastest path) into a
+    temporary file next to output_path, which is renamed into place only
+    once complete, so readers never see a half-written file.
+    """
+    suffix = COMPRESSION_SUFFIXES[compression]
+    if suffix and not output_path.endswith(suffix):
+        output_path += suffix
+    tmp_path = f"{output_path}.tmp-{os.getpid()}"
+    rows_written = None
+    conn = get_db_connection()
+    try:
+        with open_csv_output(tmp_path, compression) as csvfile:
+            if use_copy:
+                cur = conn.cursor()
+                rendered = cur.mogrify(query.strip().rstrip(";"), params).decode()
+                cur.copy_expert(f"COPY ({rendered}) TO STDOUT WITH (FORMAT csv, HEADER)", csvfile)
+            else:
+                # Named cursor: rows are streamed from the server in FETCH_BATCH_SIZE batches
+                cur = conn.cursor(name="export_query_csv")
+                cur.itersize = FETCH_BATCH_SIZE
+                cur.execute(query, params)
+                writer = csv.writer(csvfile)
+                writer.writerow(header)
+                rows_written = 0
+                while True:
+                    rows = cur.fetchmany(FETCH_BATCH_SIZE)
+                    if not rows:
+                        break
+                    writer.writerows(rows)
+                    rows_written += len(rows)
+            cur.close()
+        os.replace(tmp_path, output_path)
+    finally:
+        conn.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return output_path, rows_written
+
+
+def avg_usage(output_path=None, compression=None, precision=None, use_copy=None):
     """Find avarage data usage, avg call min and avg sms count"""
+    output_path = output_path or os.getenv("CSV_OUTPUT_PATH", "/tmp/avg_query.csv")
+    compression = compression or CSV_COMPRESSION
+    precision = CSV_PRECISION if precision is None else precision
+    use_copy = CSV_USE_COPY if use_copy is None else use_copy
+    # Reads the usage_summary materialized view (one row per customer)
+    # instead of scanning usage; the etl_pipeline_dag refreshes it daily.
+    # Rounding in SQL keeps the file free of 16-digit NUMERIC tails.
     avg_query = """
-        SELECT 
-            s.customer_id,
-            AVG(u.call_minutes::NUMERIC) AS avg_call_minutes,
-            AVG(u.data_usage::NUMERIC) AS avg_data_usage,
-            AVG(u.sms_count) AS avg_sms_count
-        FROM 
-            subscriptions s
-        JOIN
-            usage u
-        ON  
-            s.subscription_id = u.subscription_id
-        GROUP BY
-           s.customer_id
+        SELECT
+            customer_id,
+            ROUND(avg_call_minutes, %(precision)s) AS avg_call_minutes,
+            ROUND(avg_data_usage, %(precision)s) AS avg_data_usage,
+            ROUND(avg_sms_count, %(precision)s) AS avg_sms_count
+        FROM
+            usage_summary
         ORDER BY
-            s.customer_id;
+            customer_id;
     """
+    header = ["customer_id", "avg_call_minutes", "avg_data_usage", "avg_sms_count"]
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(avg_query)
-        results_query_avg= cur.fetchall()
-        cur.close()
-        conn.close()
-        logging.info("success!")
+        output_path, rows_written = export_query_csv(
+            avg_query, {"precision": precision}, header, output_path, compression, use_copy)
+        logging.info(f"Csv success to {output_path}" + (f" ({rows_written} rows)" if rows_written is not None else ""))
+        return output_path
     except Exception as e:
         logging.error(f"Failed : {e}")
         raise
-    
-    output_path = os.getenv("CSV_OUTPUT_PATH", "/tmp/avg_query.csv")
-    with open(output_path,'w',newline='') as csvfile:
-        try:
-
-            writer = csv.writer(csvfile)
-            writer.writerows(results_query_avg)
-            logging.info(f"Csv success to{output_path}")
-        except Exception as e:
-            logging.error(f"failed csv : {e}")
-            raise
 
-avg_usage()
\ No newline at end of file
+if __name__ == "__main__":
+    avg_usage()
\ No newline at end of file
@@ -32,93 +32,42 @@ def get_db_connection():
 
 ####
 base_url = "http://localhost:5001"
-customers_endpoint = f"{base_url}/customers"
-subscriptions_endpoint = f"{base_url}/subscriptions"
-payments_endpoint = f"{base_url}/payments"
+payment_totals_endpoint = f"{base_url}/aggregates/payment_totals"
 ####
 
 
-def extract_data(api_endpoint, days=30):
-    """Extract data from the API for the last days days."""
+def extract_payment_totals(api_endpoint, days=30):
+    """Fetch per-customer payment totals for the last days days, summed by the API."""
     try:
         # Calculate the date range
         end_date = datetime.now()
         start_date = end_date - timedelta(days=days)
-        
+
         # Define query parameters
         params = {
             "start_date": start_date.strftime("%Y-%m-%d"),
-            "end_date": end_date.strftime("%Y-%m-%d")
+            "end_date": end_date.strftime("%Y-%m-%d"),
+            "per_page": 1000,
         }
 
-        logging.info(f"Extracting data from {api_endpoint} for the last {days} days...")
-        response = requests.get(api_endpoint, params=params)
-        response.raise_for_status()
-        return response.json()
+        logging.info(f"Extracting payment totals from {api_endpoint} for the last {days} days...")
+        totals = []
+        while True:
+            response = requests.get(api_endpoint, params=params)
+            response.raise_for_status()
+            page = response.json()
+            totals.extend(page["data"])
+            if page["next_cursor"] is None:
+                break
+            params["cursor"] = page["next_cursor"]
+        logging.info(f"Extracted payment totals for {len(totals)} customers.")
+        return [{"customer_id": row["customer_id"], "sum_payment": row["sum_payment"]} for row in totals]
     except Exception as e:
         logging.error(f"Failed to fetch data from {api_endpoint}: {e}")
         raise
 
-customers = extract_data(customers_endpoint)  # Fetch customers data
-subscriptions = extract_data(subscriptions_endpoint)  # Fetch subscriptions data
-payments = extract_data(payments_endpoint)  # Fetch payments data
-
-######
-
-def transform_data(customers, subscriptions, payments):
-    """Aggregate payment data by customer while handling missing subscription IDs."""
-    # Step 1: Create subscription_id -> customer_id mapping
-    subscription_to_customer = {
-        subscription["subscription_id"]: subscription["customer_id"]
-        for subscription in subscriptions
-    }
-    
-    logging.info("Subsricipton to customer:")
-    for subscription_id,customer_id in subscription_to_customer.items():
-        logging.info(f"Subs ID:{subscription_id}, CUstomer ID : {customer_id}")
-
-    # Log missing subscription IDs during aggregation
-    missing_subscription_ids = set()
-    customer_payments = {}
-
-    for payment in payments:
-        subscription_id_payment = payment.get("subscription_id")
-        amount = float(payment.get("amount", 0))
-
-        if subscription_id in subscription_to_customer == subscription_id_payment:
-            # Map subscription_id to customer_id and aggregate payments
-            customer_id = subscription_to_customer[subscription_id]
-            customer_payments[customer_id] = customer_payments.get(customer_id, 0) + amount
-        else:
-            # Log missing subscription_id
-            missing_subscription_ids.add(subscription_id)
-
-    
-    # Log all missing subscription IDs
-    """"
-    if missing_subscription_ids:
-        logging.warning(f"Missing subscription IDs: {missing_subscription_ids}")
-    """
-    # Step 2: Create final transformed data with all customers
-    transformed_data = []
-    for subscription in subscriptions:
-        customer_id = customer["customer_id"]
-        sum_payment = customer_payments.get(customer_id, 0)  # Default to 0 if no payments
-        transformed_data.append({
-            "customer_id": customer_id,
-            "sum_payment": sum_payment
-        })
-
-    # Log the final aggregation
-    
-    logging.info("Final Transformed Data:")
-    for record in transformed_data:
-        logging.info(record)
-    
-    return transformed_data
-
-
-transformed_data = transform_data(customers,subscriptions,payments)
+# Postgres groups the payments; only one row per customer is transferred
+transformed_data = extract_payment_totals(payment_totals_endpoint)
 ##Load the data into db##
 
 def load_data_to_db(transformed_data):
@@ -150,7 +99,8 @@ def load_data_to_api(transformed_data, api_endpoint_app):
     """Load transformed data to the /payment_amount API endpoint."""
     try:
         logging.info(f"Loading data into API endpoint {api_endpoint_app}...")
-        response = requests.post(api_endpoint_app, json=transformed_data)
+        # The endpoint expects the records wrapped in {"data": [...]}
+        response = requests.post(api_endpoint_app, json={"data": transformed_data})
         response.raise_for_status()
         logging.info("Data successfully loaded into the API.")
     except Exception as e:
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# The API modules live at the repository root and the ETL modules in dags/utils, as in the images
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "dags", "utils")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture
+def landing(tmp_path, monkeypatch):
+    """Point the landing zone at a temporary directory and return the module."""
+    import landing_zone
+
+    landing_dir = str(tmp_path / "landing")
+    monkeypatch.setattr(landing_zone, "LANDING_DIR", landing_dir)
+    monkeypatch.setattr(landing_zone, "MANIFEST_PATH", os.path.join(landing_dir, "_manifest.json"))
+    return landing_zone
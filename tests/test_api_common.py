@@ -0,0 +1,81 @@
+import base64
+import json
+import re
+from datetime import date, datetime
+
+import pytest
+
+from api_common import (
+    decode_cursor, decode_group_cursor, encode_cursor, parse_window, payment_amount_rows,
+)
+
+
+def _token(key):
+    return base64.urlsafe_b64encode(json.dumps({"k": key}).encode()).decode().rstrip("=")
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(42)) == 42
+    assert decode_cursor(encode_cursor("Basic"), (str,)) == "Basic"
+
+
+@pytest.mark.parametrize("token", [_token(True), _token(False), _token("42"), _token(None), "not-a-cursor", ""])
+def test_decode_cursor_rejects_non_integer_keys(token):
+    with pytest.raises(ValueError):
+        decode_cursor(token)
+
+
+def test_decode_group_cursor_checks_the_grouping_type():
+    assert decode_group_cursor(encode_cursor(7), int) == 7
+    assert decode_group_cursor(encode_cursor("Premium"), str) == "Premium"
+    assert decode_group_cursor(encode_cursor("2025-01-31"), date) == date(2025, 1, 31)
+    # Null groups sort first, so null is a valid cursor for every grouping
+    assert decode_group_cursor(encode_cursor(None), int) is None
+    for token, key_type in ((_token("abc"), int), (_token(True), int), (_token(5), str), (_token("soon"), date)):
+        with pytest.raises(ValueError):
+            decode_group_cursor(token, key_type)
+
+
+def test_parse_window_includes_a_date_only_end_day():
+    assert parse_window({}) == (None, None)
+    assert parse_window({"start_date": "2025-01-01", "end_date": "2025-01-31"}) == (
+        datetime(2025, 1, 1), datetime(2025, 2, 1))
+    # A datetime end bound is taken as given
+    assert parse_window({"end_date": "2025-01-31T12:00:00"}) == (None, datetime(2025, 1, 31, 12))
+    with pytest.raises(ValueError):
+        parse_window({"start_date": "31/01/2025"})
+
+
+def test_report_window_matches_the_aggregate_endpoint():
+    import reports
+
+    params = {"start_date": "2025-01-01", "end_date": "2025-01-31"}
+    lower, upper = parse_window(params)
+    assert reports._window_params(params) == {"start_date": lower, "end_date": upper}
+
+
+def test_payment_amount_rows_keeps_the_last_entry_per_customer():
+    data = {"data": [
+        {"customer_id": 1, "sum_payment": 10},
+        {"customer_id": 2, "sum_payment": "20.50"},
+        {"customer_id": 1, "sum_payment": 30},
+    ]}
+    assert payment_amount_rows(data) == [(1, 30), (2, "20.50")]
+
+
+@pytest.mark.parametrize("data, message", [
+    ({"data": 5}, "'data' key must contain a list"),
+    ([1, 2], "Payload must be a JSON object"),
+    ({"data": [{"customer_id": 1}]}, "Each entry must include"),
+    ({"data": [{"customer_id": [1], "sum_payment": 1}]}, "data[0].customer_id"),
+    ({"data": [{"customer_id": None, "sum_payment": 1}]}, "data[0].customer_id"),
+    ({"data": [{"customer_id": 1, "sum_payment": 1}, {"customer_id": True, "sum_payment": 1}]}, "data[1].customer_id"),
+    ({"data": [{"customer_id": 2 ** 40, "sum_payment": 1}]}, "data[0].customer_id"),
+    ({"data": [{"customer_id": 1, "sum_payment": "abc"}]}, "data[0].sum_payment"),
+    ({"data": [{"customer_id": 1, "sum_payment": None}]}, "data[0].sum_payment"),
+    ({"data": [{"customer_id": 1, "sum_payment": "NaN"}]}, "data[0].sum_payment"),
+    ({"data": [{"customer_id": 1, "sum_payment": "99999999.995"}]}, "data[0].sum_payment"),
+])
+def test_payment_amount_rows_rejects_invalid_payloads(data, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        payment_amount_rows(data)
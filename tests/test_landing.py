@@ -0,0 +1,111 @@
+import os
+
+import numpy as np
+import pytest
+
+SUBSCRIPTIONS = [
+    {"subscription_id": 1, "customer_id": 1},
+    {"subscription_id": 2, "customer_id": 1},
+    {"subscription_id": 3, "customer_id": 2},
+    # Customer 3 has a subscription but no payments
+    {"subscription_id": 4, "customer_id": 3},
+]
+PAYMENTS = [{"payment_id": i, "subscription_id": i % 3 + 1, "amount": f"{i}.25"} for i in range(1, 41)]
+
+
+def expected_totals():
+    customers = {row["subscription_id"]: row["customer_id"] for row in SUBSCRIPTIONS}
+    totals = {customer_id: 0.0 for customer_id in customers.values()}
+    for payment in PAYMENTS:
+        totals[customers[payment["subscription_id"]]] += float(payment["amount"])
+    return sorted((customer_id, round(total, 2)) for customer_id, total in totals.items())
+
+
+@pytest.fixture(params=["parquet", "ndjson"])
+def landed(request, landing, monkeypatch):
+    """Land baselines of SUBSCRIPTIONS and PAYMENTS in several small parts read in small batches."""
+    if request.param == "parquet":
+        pytest.importorskip("pyarrow")
+    monkeypatch.setattr(landing, "LANDING_READ_BATCH_ROWS", 4)
+    landing.land_rows("subscriptions", SUBSCRIPTIONS, "subscription_id", request.param, baseline=True, part_rows=3)
+    entries = landing.land_rows("payments", PAYMENTS, "payment_id", request.param, baseline=True, part_rows=7)
+    assert [entry["rows"] for entry in entries] == [7, 7, 7, 7, 7, 5]
+    return landing
+
+
+def test_landing_totals(landed):
+    from vectorized_transform import transform_landed_payments
+
+    totals = sorted((row["customer_id"], row["sum_payment"]) for row in transform_landed_payments())
+    assert totals == expected_totals()
+
+
+def test_chunked_totals_match_and_include_customers_without_payments(landed):
+    from chunked_aggregate import chunked_payment_totals
+
+    totals = sorted((row["customer_id"], row["sum_payment"]) for batch in chunked_payment_totals() for row in batch)
+    assert totals == expected_totals()
+    assert (3, 0.0) in totals
+
+
+def test_transforms_refuse_to_run_without_a_baseline(landing):
+    from chunked_aggregate import chunked_payment_totals
+
+    landing.land_rows("payments", PAYMENTS, "payment_id")
+    with pytest.raises(RuntimeError, match="No full extract"):
+        list(chunked_payment_totals())
+
+
+def test_spilling_aggregator_matches_in_memory_sums():
+    from chunked_aggregate import SpillingAggregator
+
+    rng = np.random.default_rng(7)
+    batches = [(rng.integers(0, 500, 1000), rng.integers(0, 10000, 1000).astype(np.float64)) for _ in range(20)]
+
+    def run(aggregator):
+        for keys, values in batches:
+            aggregator.add(keys, {"value": values})
+        merged = {}
+        for keys, sums, counts in aggregator.results():
+            for key, total, count in zip(keys.tolist(), sums["value"].tolist(), counts.tolist()):
+                merged[key] = (total, count)
+        return merged
+
+    # A budget of a few keys forces a spill on nearly every batch
+    assert run(SpillingAggregator(["value"], memory_budget=64, partitions=4)) == run(SpillingAggregator(["value"]))
+
+
+def test_failed_extract_leaves_no_parts(landing):
+    def rows():
+        yield from PAYMENTS[:10]
+        raise ConnectionError("stream broken")
+
+    with pytest.raises(ConnectionError):
+        landing.land_rows("payments", rows(), "payment_id", "ndjson", baseline=True, part_rows=3)
+    assert landing.load_manifest() == {"files": [], "baselines": {}}
+    leftovers = [name for _, _, names in os.walk(landing.LANDING_DIR) for name in names]
+    assert leftovers == []
+
+
+def test_incremental_extract_lands_late_rows_once(landing, monkeypatch):
+    import etl_pipeline
+
+    source = [row for row in PAYMENTS if row["payment_id"] != 38]
+
+    def fake_extract_table(table, filters=None, session=None, consume=list):
+        after = (filters or {}).get("after", 0)
+        rows = [row for row in sorted(source, key=lambda row: row["payment_id"]) if row["payment_id"] > after]
+        return consume(iter(rows)), len(rows)
+
+    monkeypatch.setattr(etl_pipeline, "extract_table", fake_extract_table)
+    monkeypatch.setattr(etl_pipeline, "EXTRACT_OVERLAP_KEYS", 5)
+
+    assert etl_pipeline.extract_incremental("payments") == 39
+    # Payment 38 commits after 40 was landed; 41 is new
+    source.extend([PAYMENTS[37], {"payment_id": 41, "subscription_id": 1, "amount": "1.00"}])
+    assert etl_pipeline.extract_incremental("payments") == 2
+    assert etl_pipeline.extract_incremental("payments") == 0
+
+    landed_ids = landing.read_columns("payments", ["payment_id"])["payment_id"]
+    assert sorted(int(key) for key in landed_ids) == list(range(1, 42))
+    assert landing.high_water_mark("payments") == 41